@@ -0,0 +1,195 @@
+"""
+Chunk Tree Hasher Class for incremental re-hashing of modified files,
+keeps a Merkle tree of fixed size chunk digests per file in the consumer database.
+"""
+import hashlib
+import os
+import random
+from logger import Logger
+from database import DB, NotFoundError, InsertError, UpdateError
+
+
+DIGEST_SIZE = hashlib.md5().digest_size
+
+
+class ChunkTreeBuilder:
+    """
+    Splits a stream of file blocks into fixed size chunks and digests each chunk,
+    fed from the consumer hashing read loop so building a tree costs no extra I/O.
+    """
+    def __init__(self, chunk_size: int):
+        """
+        Class Constructor.
+        :param chunk_size: For the tree chunk size in bytes.
+        """
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.digests = []
+        self.size = 0
+
+    def update(self, data: bytes) -> None:
+        """
+        Adds the next file block.
+        :param data: For the file block.
+        """
+        self.size += len(data)
+        self.buffer += data
+        if len(self.buffer) < self.chunk_size:
+            return None
+        offset = 0
+        with memoryview(self.buffer) as view:
+            while len(view) - offset >= self.chunk_size:
+                self.digests.append(hashlib.md5(view[offset:offset + self.chunk_size]).digest())
+                offset += self.chunk_size
+        del self.buffer[:offset]
+
+    def finish(self) -> list:
+        """
+        Digests the last partial chunk.
+        :return: The chunk digests in file order.
+        """
+        if self.buffer:
+            self.digests.append(hashlib.md5(self.buffer).digest())
+            self.buffer.clear()
+        return self.digests
+
+
+class ChunkTreeHasher:
+
+    def __init__(self, db: DB, chunk_size: int, sample_chunks: int, read_size: int):
+        """
+        Class Constructor.
+        :param db: For the consumer database to store the trees in.
+        :param chunk_size: For the tree chunk size in bytes.
+        :param sample_chunks: For the number of unchanged chunks to re-read and compare on every update.
+        :param read_size: For the read block size.
+        """
+        self.db = db
+        self.table = 'File_Trees'
+        self.chunk_size = chunk_size
+        self.sample_chunks = sample_chunks
+        self.read_size = read_size
+        self.bytes_read = 0
+        self.bytes_saved = 0
+        self.class_logger = Logger('ChunkTreeHasher')
+
+    def setup(self) -> None:
+        """
+        Creates the trees table.
+        """
+        self.db.create_table(self.table, 'File_Name TEXT PRIMARY KEY, File_Size INTEGER, Chunk_Size INTEGER, '
+                                         'Chunk_Hashes BLOB, Root_Hash TEXT')
+
+    def new_builder(self) -> ChunkTreeBuilder:
+        """
+        Creates a builder to feed from an existing read loop.
+        :return: The chunk tree builder.
+        """
+        return ChunkTreeBuilder(self.chunk_size)
+
+    @staticmethod
+    def merkle_root(digests: list) -> str:
+        """
+        Computes the Merkle tree root of a given list of chunk digests.
+        :param digests: For the chunk digests.
+        :return: The root digest as hex string.
+        """
+        if not digests:
+            return hashlib.md5().hexdigest()
+        level = digests
+        while len(level) > 1:
+            # An odd node is promoted to the next level as is
+            level = [hashlib.md5(level[i] + level[i + 1]).digest() if i + 1 < len(level) else level[i]
+                     for i in range(0, len(level), 2)]
+        return level[0].hex()
+
+    def store(self, file: str, size: int, digests: list) -> str:
+        """
+        Stores a given file chunk digests and root.
+        :param file: For the file name.
+        :param size: For the file size the digests were computed for.
+        :param digests: For the chunk digests.
+        :return: The root digest as hex string.
+        """
+        root_hash = self.merkle_root(digests)
+        try:
+            self.db.replace_row(self.table, 'File_Name, File_Size, Chunk_Size, Chunk_Hashes, Root_Hash',
+                                (file, size, self.chunk_size, b''.join(digests), root_hash))
+        except InsertError as err:
+            self.class_logger.logger.error("Unable to store chunk tree of '%s', Error: %s", file, err)
+        return root_hash
+
+    def read_chunks(self, f, start_index: int) -> tuple:
+        """
+        Digests the chunks from a given chunk index until EOF.
+        :param f: For the opened file.
+        :param start_index: For the first chunk index to read.
+        :return: The chunk digests and the number of bytes read.
+        """
+        builder = self.new_builder()
+        f.seek(start_index * self.chunk_size)
+        bytes_read = 0
+        block = f.read(self.read_size)
+        while block:
+            bytes_read += len(block)
+            builder.update(block)
+            block = f.read(self.read_size)
+        return builder.finish(), bytes_read
+
+    def update(self, file: str) -> tuple:
+        """
+        Re-hashes a modified file, reading only the chunks that may have changed:
+        1. a file without a stored tree, with a different chunk size or that got smaller is fully re-hashed.
+        2. otherwise a sample of the stored full chunks is re-read and compared, any mismatch means a full re-hash.
+        3. if all samples match, only the last stored partial chunk and the appended data are re-hashed.
+        :param file: For the modified file.
+        :return: The new root digest, the number of bytes read and the number of bytes saved.
+        """
+        try:
+            row = self.db.select_row(self.table, 'File_Name', file)
+        except NotFoundError:
+            row = None
+        with open(file, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            start_index = 0
+            digests = []
+            bytes_read = 0
+            if row is not None and row[2] == self.chunk_size and size >= row[1]:
+                stored_size, stored_hashes = row[1], row[3]
+                digests = [stored_hashes[i:i + DIGEST_SIZE] for i in range(0, len(stored_hashes), DIGEST_SIZE)]
+                start_index = stored_size // self.chunk_size
+                for index in random.sample(range(start_index), min(self.sample_chunks, start_index)):
+                    f.seek(index * self.chunk_size)
+                    chunk = f.read(self.chunk_size)
+                    bytes_read += len(chunk)
+                    if hashlib.md5(chunk).digest() != digests[index]:
+                        start_index = 0
+                        break
+            tail_digests, tail_read = self.read_chunks(f, start_index)
+        digests = digests[:start_index] + tail_digests
+        bytes_read += tail_read
+        bytes_saved = max(size - bytes_read, 0)
+        self.bytes_read += bytes_read
+        self.bytes_saved += bytes_saved
+        return self.store(file, size, digests), bytes_read, bytes_saved
+
+    def forget(self, file: str) -> None:
+        """
+        Removes a given file tree.
+        :param file: For the deleted file name.
+        """
+        self.db.delete_value(self.table, 'File_Name', file)
+
+    def rename(self, file: str, new_name: str) -> None:
+        """
+        Re-keys a given file tree to its new name, the content did not change so neither did the tree.
+        :param file: For the moved file name.
+        :param new_name: For the file destination name.
+        """
+        # A file moved over an existing one replaces it, and its tree too
+        self.db.delete_value(self.table, 'File_Name', new_name)
+        try:
+            self.db.update_table(self.table, 'File_Name', new_name, 'File_Name', file)
+        except UpdateError as err:
+            self.class_logger.logger.error("Unable to rename chunk tree of '%s', Error: %s", file, err)
+            self.forget(file)
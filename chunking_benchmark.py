@@ -0,0 +1,104 @@
+"""
+Benchmark for the content defined chunking stage on the tester files.
+Compares the consumer hashing read loop throughput alone and with the chunker fed from it,
+and reports the dedup ratio of every file and of an edited revision of each file.
+"""
+import hashlib
+import os
+import tempfile
+import time
+from chunking import ChunkIndex, chunk_file
+from database import DB
+from config_parser import get_configuration
+
+
+SOURCE_DIR = str(get_configuration("tester_source_dir"))
+READ_SIZE = int(get_configuration("chunk_size"))
+MIN_SIZE = int(get_configuration("min_size", "content_chunking"))
+AVG_SIZE = int(get_configuration("avg_size", "content_chunking"))
+MAX_SIZE = int(get_configuration("max_size", "content_chunking"))
+ROUNDS = 20
+
+
+def read_loop(data: bytes, listeners: tuple = ()) -> str:
+    """
+    Same loop as Consumer.hash_file, on in memory data to leave disk I/O out of the measurement.
+    :param data: For the file content.
+    :param listeners: For objects with an 'update' method to feed every block to.
+    :return: The data md5 hash.
+    """
+    file_hash = hashlib.md5()
+    for offset in range(0, len(data), READ_SIZE):
+        block = data[offset:offset + READ_SIZE]
+        file_hash.update(block)
+        for listener in listeners:
+            listener.update(block)
+    return file_hash.hexdigest()
+
+
+def time_read_loops(contents: dict, chunk_index: ChunkIndex = None) -> tuple:
+    """
+    Runs the read loop over all the files for the benchmark rounds.
+    :param contents: For the files content.
+    :param chunk_index: For the chunk index to feed a new chunker from every loop, None for md5 only.
+    :return: The elapsed time in seconds and the chunk lists of the last round.
+    """
+    chunk_lists = {}
+    start_time = time.perf_counter()
+    for _ in range(ROUNDS):
+        for file, data in contents.items():
+            if chunk_index is None:
+                read_loop(data)
+            else:
+                chunker = chunk_index.new_chunker()
+                read_loop(data, (chunker,))
+                chunk_lists[file] = chunker.finish()
+    return time.perf_counter() - start_time, chunk_lists
+
+
+def edit_revision(data: bytes) -> bytes:
+    """
+    Creates a near identical revision of a file by inserting a few KB in the middle.
+    :param data: For the original file content.
+    :return: The revised content.
+    """
+    middle = len(data) // 2
+    return data[:middle] + os.urandom(4096) + data[middle:]
+
+
+def benchmark_main():
+
+    files = sorted(os.listdir(SOURCE_DIR))
+    contents = {}
+    for file in files:
+        with open(os.path.join(SOURCE_DIR, file), 'rb') as f:
+            contents[file] = f.read()
+    total_size = sum(len(data) for data in contents.values())
+    print(f"[+] Benchmarking {len(files)} files, {total_size / 1048576:.2f} MB x {ROUNDS} rounds, "
+          f"read size {READ_SIZE} bytes, chunk sizes {MIN_SIZE}/{AVG_SIZE}/{MAX_SIZE} bytes.")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        chunk_index = ChunkIndex(DB(os.path.join(temp_dir, 'Benchmark_DB')), MIN_SIZE, AVG_SIZE, MAX_SIZE)
+        chunk_index.setup()
+        md5_time, _ = time_read_loops(contents)
+        chunking_time, chunk_lists = time_read_loops(contents, chunk_index)
+
+        chunks_count = sum(len(chunks) for chunks in chunk_lists.values())
+        rounds_size = total_size * ROUNDS / 1048576
+        print(f"   - md5 only:             {rounds_size / md5_time:8.2f} MB/s")
+        print(f"   - md5 and chunking:     {rounds_size / chunking_time:8.2f} MB/s, "
+              f"{chunks_count} chunks, average {total_size / chunks_count:.0f} bytes")
+
+        print("[+] Dedup ratio per file, then per edited revision:")
+        for file, chunks in chunk_lists.items():
+            ratio = chunk_index.register(file, chunks)
+            revision_file = os.path.join(temp_dir, f"{file}.rev")
+            with open(revision_file, 'wb') as f:
+                f.write(edit_revision(contents[file]))
+            revision_ratio = chunk_index.register(revision_file, chunk_file(revision_file, chunk_index.new_chunker(),
+                                                                            READ_SIZE))
+            print(f"   - {file:32} {ratio:7.1%} {revision_ratio:7.1%}")
+
+
+if __name__ == "__main__":
+    benchmark_main()
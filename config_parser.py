@@ -27,7 +27,7 @@ def get_configuration(line: str, config_type: str = None):
     except (FileNotFoundError, ValueError) as err:
         print(f"[!] Unable to parse config file, Error: {err}")
 
-    if config_type == "logger":
+    if config_type is not None:
         return data[config_type][line]
     else:
         return data[line]
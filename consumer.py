@@ -1,7 +1,10 @@
 """
 Consumer Class for running the main project logic, see readme for more details.
 """
+import logging
 import pathlib
+import socket
+import sqlite3
 import sys
 from time import sleep
 import hashlib
@@ -11,29 +14,60 @@ import pika.exceptions
 import enum
 from threading import Thread
 from logger import Logger
-from database import DB, CreateTableError, UpdateError, DeleteError
+from database import DB, ShardedDB, OpenError, CreateTableError, InsertError, UpdateError, DeleteError, NotFoundError
+from chunk_tree import ChunkTreeHasher
+from chunking import ChunkIndex
+from index_client import DedupIndexClient, DedupIndexError
 from config_parser import get_configuration
 
 
 class Consumer(Thread):
-    def __init__(self, host: str):
+    def __init__(self, host: str, profiler=None):
         """
         Class Constructor.
         :param host: For the IP Address to configure.
+        :param profiler: For the optional Profiler sampling the message handling.
         """
         super(Consumer).__init__()
         self.host = host
         self.queue = str(get_configuration("rabbitmq_queue_name"))
         self.connection = None
         self.channel = None
-        self.file_types = [".ppt", ".pptx", ".pdf", ".txt", ".html", ".mp4",
-                           ".jpg", ".png", ".xls", ".xlsx", ".xml", ".vsd", ".py",
-                           ".doc", ".docx", ".json"]
+        self.file_types = frozenset(get_configuration("file_types"))
         self.chunk_size = get_configuration("chunk_size")
         self.RECONNECTING_BUFFER = get_configuration("reconnecting_buffer")
         self.DEFAULT_PROCESSING_TIME = get_configuration("default_processing_time")
-        self.hash = hashlib.md5()
-        self.db = DB(str(get_configuration("consumer_database_name")))
+        try:
+            if str(get_configuration("enabled", "sharding")) == "true":
+                self.db = ShardedDB(str(get_configuration("consumer_database_name")),
+                                    int(get_configuration("shard_count", "sharding")),
+                                    str(get_configuration("consumer_database_wal_writer")) == "true",
+                                    writer_batch=int(get_configuration("writer_batch", "sharding")))
+            else:
+                self.db = DB(str(get_configuration("consumer_database_name")),
+                             str(get_configuration("consumer_database_wal_writer")) == "true")
+        except OpenError as err:
+            print(err)
+            sys.exit(1)
+        self.chunk_tree = None
+        if str(get_configuration("enabled", "incremental_hashing")) == "true":
+            self.chunk_tree = ChunkTreeHasher(self.db, int(get_configuration("chunk_size", "incremental_hashing")),
+                                              int(get_configuration("sample_chunks", "incremental_hashing")),
+                                              int(self.chunk_size))
+        self.chunk_index = None
+        if str(get_configuration("enabled", "content_chunking")) == "true":
+            self.chunk_index = ChunkIndex(self.db, int(get_configuration("min_size", "content_chunking")),
+                                          int(get_configuration("avg_size", "content_chunking")),
+                                          int(get_configuration("max_size", "content_chunking")))
+        self.dedup_index = None
+        self.reconcile_needed = False
+        if str(get_configuration("enabled", "dedup_index")) == "true":
+            unix_socket = str(get_configuration("unix_socket", "dedup_index"))
+            self.dedup_index = DedupIndexClient(str(get_configuration("host", "dedup_index")),
+                                                int(get_configuration("port", "dedup_index")),
+                                                unix_socket if unix_socket else None,
+                                                int(get_configuration("pool_size", "dedup_index")))
+        self.profiler = profiler
         self.class_logger = Logger('Consumer')
 
     def connect(self) -> None:
@@ -69,7 +103,7 @@ class Consumer(Thread):
                 break
             else:
                 print(f"[!] Failed to reconnect to RabbitMQ server.")
-                self.class_logger.logger.error("Failed to reconnect to RabbitMQ server for {attempts} times.")
+                self.class_logger.logger.error("Failed to reconnect to RabbitMQ server for %s times.", attempts)
                 self.close_connection()
 
     def consume(self) -> None:
@@ -88,12 +122,37 @@ class Consumer(Thread):
         Method For setting up the consumer database.
         """
         try:
-            self.db.create_table('Files', 'File_Name, File_Hash')
+            # The AUTOINCREMENT key keeps incremental export watermarks valid after deletes
+            self.db.create_table('Files', 'File_Name, File_Hash, File_Id INTEGER PRIMARY KEY AUTOINCREMENT')
+            if self.chunk_tree is not None:
+                self.chunk_tree.setup()
+            if self.chunk_index is not None:
+                self.chunk_index.setup()
+            if self.dedup_index is not None:
+                # Claims made while the dedup index service was unreachable, left from a previous run as well
+                self.db.create_table('Pending_Claims', 'File_Name, File_Hash')
+                self.reconcile_needed = True
         except CreateTableError as err:
             print(err)
             sys.exit(1)
 
     def on_notification_receive(self, channel, method, properties, body):
+        """
+        RabbitMQ callback, acknowledges the received message and handles it.
+        A message coalesced by the producer backpressure controller holds one event per line.
+        :param channel: For RabbitMQ channel.
+        :param method: For RabbitMQ delivery method.
+        :param properties: For RabbitMQ properties.
+        :param body: For received event message.
+        """
+        self.channel.basic_ack(delivery_tag=method.delivery_tag)
+        for event in body.splitlines():
+            if self.profiler is not None and self.profiler.enabled:
+                self.profiler.profile_call(self.handle_event, event)
+            else:
+                self.handle_event(event)
+
+    def handle_event(self, body: bytes) -> None:
         """
         This method will do the following on the received events:
         1. if 'created':
@@ -103,26 +162,39 @@ class Consumer(Thread):
         2. if 'deleted':
           - delete file from db.
         3. if 'moved' or 'modified':
-          - save to log file.
-        :param channel: For RabbitMQ channel.
-        :param method: For RabbitMQ delivery method.
-        :param properties: For RabbitMQ properties.
+          - save to log file,
+          - re-hash a modified file or re-key a moved file chunk tree.
         :param body: For received event message.
         """
         file_name = None
         file_hash = None
-        self.channel.basic_ack(delivery_tag=method.delivery_tag)
         decoded_msg = body.decode().split()
+        # Modified files are re-hashed incrementally, created files build their chunk tree and content defined
+        # chunks while being hashed
+        incremental_modified = self.chunk_tree is not None and EventTypes.MODIFIED in decoded_msg
+        tree_builder = None
+        chunker = None
+        if EventTypes.CREATED in decoded_msg:
+            if self.chunk_tree is not None:
+                tree_builder = self.chunk_tree.new_builder()
+            if self.chunk_index is not None:
+                chunker = self.chunk_index.new_chunker()
+        listeners = tuple(listener for listener in (tree_builder, chunker) if listener is not None)
+
+        # Moved events carry their destination after the source, nothing is left to hash at the source
+        moved_to = decoded_msg[2] if EventTypes.MOVED in decoded_msg and len(decoded_msg) > 2 else None
 
         # Getting file path and hash
         try:
             file_name = decoded_msg[1]
-            file_hash = self.hash_file(file_name)
+            if not incremental_modified and moved_to is None:
+                file_hash = self.hash_file(file_name, listeners)
         except FileNotFoundError as err:
             self.class_logger.logger.error(f"[!] Unable to get file path or hash, Error: {err}")
 
-        # Validating file type
-        file_type = self.validate_file_type(file_name)
+        # Validating file type, moved events by their destination the same way the watcher filters them,
+        # e.g. a 'x.docx.tmp' saved over 'x.docx' must still replace the 'x.docx' chunk tree
+        file_type = self.validate_file_type(moved_to or file_name)
 
         # Main method logic
         if file_type:
@@ -132,8 +204,11 @@ class Consumer(Thread):
                 size = self.get_file_size_in_bytes(file_name)
                 processing_time = self.get_file_process_time(size)
                 print(f"[+] Received created event, processing time will be {processing_time} seconds.")
+                if tree_builder is not None:
+                    self.chunk_tree.store(file_name, tree_builder.size, tree_builder.finish())
+                final_name = file_name
                 # Insert hash value only if it does not exist in db
-                if self.db.insert_if_not_exists('Files', 'File_Hash', file_hash):
+                if self.claim_file_hash(file_name, file_hash):
                     try:
                         self.db.update_table('Files', 'File_Name', file_name, 'File_Hash', file_hash)
                     except UpdateError as err:
@@ -143,24 +218,41 @@ class Consumer(Thread):
                     try:
                         new_name = f"{file_name}{'_dup_#'}"
                         os.rename(file_name, new_name)
-                        self.class_logger.logger.debug(f"Changed {file_name} to {new_name}")
+                        final_name = new_name
+                        self.class_logger.logger.debug("Changed %s to %s", file_name, new_name)
                     except FileNotFoundError as err:
                         self.class_logger.logger.error(f"Unable to rename {file_name}, Error: {err}")
+                # Registered under the name the file is left with, the chunks of an exact duplicate are all known
+                if chunker is not None and file_hash is not None:
+                    self.chunk_index.register(final_name, chunker.finish())
                 sleep(processing_time)
             # For delete event
             elif EventTypes.DELETED in decoded_msg:
                 print(f"[+] Received deleted event, processing time will be {self.DEFAULT_PROCESSING_TIME} seconds.")
                 try:
                     # file_hash = self.db.select_value('Files', 'File_Hash')
+                    if self.dedup_index is not None:
+                        self.release_file_hash(file_name)
                     self.db.delete_value('Files', 'File_Name', file_name)
                     self.db.delete_value('Files', 'File_Name', file_hash)
+                    if self.chunk_index is not None:
+                        self.chunk_index.forget(file_name)
+                    if self.chunk_tree is not None:
+                        self.chunk_tree.forget(file_name)
                     # sleep(processing_time)
                 except DeleteError as err:
                     print(f"[!] Unable to delete '{file_hash}' from db, Error: {err}.")
             # For moved or modified event
             elif EventTypes.MOVED in decoded_msg or EventTypes.MODIFIED in decoded_msg:
                 print(f"[+] Received modified or moved event, processing time will be {self.DEFAULT_PROCESSING_TIME} seconds.")
-                self.class_logger.logger.debug(f"Received '{decoded_msg}'.")
+                self.class_logger.logger.debug("Received '%s'.", decoded_msg)
+                if incremental_modified:
+                    self.rehash_modified_file(file_name)
+                elif moved_to is not None and self.chunk_tree is not None:
+                    try:
+                        self.chunk_tree.rename(file_name, moved_to)
+                    except DeleteError as err:
+                        print(f"[!] Unable to move '{file_name}' chunk tree, Error: {err}.")
 
     def run(self):
         """
@@ -179,23 +271,124 @@ class Consumer(Thread):
                 self.reconnect()
                 self.consume()
 
-    def hash_file(self, file: str) -> str:
+    def claim_file_hash(self, file_name: str, file_hash: str) -> bool:
+        """
+        Claims a file hash in the shared dedup index service when configured, the local db keeps a copy
+        of the claimed hashes. Falls back to the local db when the service is unreachable, recording the claim
+        to reconcile with the service once reachable again.
+        :param file_name: For the file name, stored with its node name as the claim owner.
+        :param file_hash: For the file md5 hash.
+        :return: True if the hash was not claimed before, False otherwise.
+        """
+        if self.dedup_index is not None and file_hash is not None:
+            try:
+                if self.reconcile_needed:
+                    self.reconcile_claims()
+                claimed = self.dedup_index.claim([(file_hash, f"{socket.gethostname()}:{file_name}")])[0]
+                if claimed:
+                    self.db.insert_if_not_exists('Files', 'File_Hash', file_hash)
+                return claimed
+            except (OSError, DedupIndexError) as err:
+                print(f"[!] Unable to reach the dedup index service, using the local db, Error: {err}.")
+                self.class_logger.logger.error("Unable to reach the dedup index service, Error: %s.", err)
+            claimed = self.db.insert_if_not_exists('Files', 'File_Hash', file_hash)
+            if claimed:
+                try:
+                    self.db.insert_many('Pending_Claims', 'File_Name, File_Hash', [(file_name, file_hash)])
+                    self.reconcile_needed = True
+                except InsertError as err:
+                    self.class_logger.logger.error("Unable to record the pending claim of '%s', Error: %s.",
+                                                   file_name, err)
+            return claimed
+        return self.db.insert_if_not_exists('Files', 'File_Hash', file_hash)
+
+    def reconcile_claims(self) -> None:
+        """
+        Registers the claims made while the dedup index service was unreachable.
+        A hash another node claimed in the meantime is a duplicate the fallback missed, it is reported
+        and dropped from the local db, so deleting the file never releases the other node claim.
+        """
+        try:
+            pending = [row for _, rows, _ in self.db.iterate_table('Pending_Claims') for row in rows]
+        except sqlite3.Error as err:
+            self.class_logger.logger.error("Unable to read the pending claims, Error: %s.", err)
+            return None
+        if pending:
+            node_name = socket.gethostname()
+            results = self.dedup_index.claim([(file_hash, f"{node_name}:{file_name}")
+                                              for file_name, file_hash in pending])
+            for (file_name, file_hash), claimed in zip(pending, results):
+                if not claimed:
+                    print(f"[!] '{file_name}' duplicates a file claimed by another node while the dedup index "
+                          f"service was unreachable.")
+                    self.class_logger.logger.error("Reconciled claim of '%s' (%s) is a duplicate of another node "
+                                                   "file.", file_name, file_hash)
+                try:
+                    if not claimed:
+                        self.db.delete_value('Files', 'File_Hash', file_hash)
+                    self.db.delete_value('Pending_Claims', 'File_Hash', file_hash)
+                except DeleteError as err:
+                    self.class_logger.logger.error("Unable to remove the reconciled claim of '%s', Error: %s.",
+                                                   file_name, err)
+            self.class_logger.logger.info("Reconciled %s pending claims with the dedup index service.",
+                                          len(pending))
+        self.reconcile_needed = False
+
+    def release_file_hash(self, file_name: str) -> None:
+        """
+        Releases a deleted file hash from the shared dedup index service, the hash is taken from the local db.
+        The release carries the same owner name as the claim, the service ignores it for any other owner.
+        :param file_name: For the deleted file name.
+        """
+        try:
+            if self.db.select_row('Pending_Claims', 'File_Name', file_name) is not None:
+                # Never registered with the service, where another node may own the hash
+                self.db.delete_value('Pending_Claims', 'File_Name', file_name)
+                return None
+            row = self.db.select_row('Files', 'File_Name', file_name)
+            if row is not None:
+                self.dedup_index.release([(row[1], f"{socket.gethostname()}:{file_name}")])
+        except (OSError, DedupIndexError, NotFoundError, DeleteError) as err:
+            self.class_logger.logger.error("Unable to release '%s' from the dedup index service, Error: %s.",
+                                           file_name, err)
+
+    def rehash_modified_file(self, file: str) -> None:
+        """
+        Incrementally re-hashes a modified file and reports the saved I/O.
+        :param file: For the modified file.
+        """
+        try:
+            root_hash, bytes_read, bytes_saved = self.chunk_tree.update(file)
+        except FileNotFoundError as err:
+            self.class_logger.logger.error(f"Unable to re-hash '{file}', Error: {err}")
+            return None
+        print(f"[+] Re-hashed modified file, read {bytes_read} bytes and saved {bytes_saved} bytes of I/O.")
+        self.class_logger.logger.info("File '%s' root hash is '%s', read %s bytes, saved %s bytes "
+                                      "(%s bytes saved in total).", file, root_hash, bytes_read, bytes_saved,
+                                      self.chunk_tree.bytes_saved)
+
+    def hash_file(self, file: str, listeners: tuple = ()) -> str:
         """
         Generating md5 hash for a given file.
         :param file: For the file to hash.
+        :param listeners: For objects with an 'update' method to feed every read block to, sharing the read loop.
         :return: The given file md5 hash code.
         """
         try:
-            file_to_hash = open(file, 'rb')
-            # For file first block
-            chunk = file_to_hash.read(int(self.chunk_size))
-            # Read until EOF
-            while chunk:
-                self.hash.update(chunk)
+            file_hash = hashlib.md5()
+            with open(file, 'rb') as file_to_hash:
+                # For file first block
                 chunk = file_to_hash.read(int(self.chunk_size))
+                # Read until EOF
+                while chunk:
+                    file_hash.update(chunk)
+                    for listener in listeners:
+                        listener.update(chunk)
+                    chunk = file_to_hash.read(int(self.chunk_size))
             # Returns the file hash
-            hash_result = self.hash.hexdigest()
-            self.class_logger.logger.debug(f"File '{file}' md5 hash is: '{hash_result}'.")
+            hash_result = file_hash.hexdigest()
+            if self.class_logger.logger.isEnabledFor(logging.DEBUG):
+                self.class_logger.logger.debug("File '%s' md5 hash is: '%s'.", file, hash_result)
             return hash_result
         except FileNotFoundError as err:
             self.class_logger.logger.error(f"Unable to generate md5 hash for '{file}', Error: {err}")
@@ -207,12 +400,10 @@ class Consumer(Thread):
         :return: True if file type is supported, False otherwise.
         """
         file_type = pathlib.Path(file).suffix
-        if file_type in self.file_types:
-            self.class_logger.logger.debug(f"File type '{file_type}' is supported.")
-            return True
-        else:
-            self.class_logger.logger.debug(f"File type '{file_type}' is NOT supported.")
-            return False
+        supported = file_type in self.file_types
+        if self.class_logger.logger.isEnabledFor(logging.DEBUG):
+            self.class_logger.logger.debug("File type '%s' is %s.", file_type, "supported" if supported else "NOT supported")
+        return supported
 
     def get_file_size_in_bytes(self, file: str) -> int:
         """
@@ -222,7 +413,8 @@ class Consumer(Thread):
         """
         try:
             file_size = os.path.getsize(file)
-            self.class_logger.logger.debug(f"File '{file}' size is: {file_size}")
+            if self.class_logger.logger.isEnabledFor(logging.DEBUG):
+                self.class_logger.logger.debug("File '%s' size is: %s", file, file_size)
             return file_size
         except FileNotFoundError as err:
             self.class_logger.logger.error(f"Unable to get file '{file}' size, Error: {err}")
@@ -1,5 +1,12 @@
+import csv
+import gzip
 import json
+import logging
+import queue
 import sqlite3
+import zlib
+from concurrent.futures import Future
+from threading import Lock, RLock, Thread
 from logger import Logger
 
 
@@ -7,19 +14,24 @@ class CustomContextManager:
     """
     Custom Context Manager Class to manage DB resources with the 'with' key word.
     """
+    class_logger = None
+
     def __init__(self, name: str):
         """
         Initializing DB.
         """
         self.name = name
-        self.class_logger = Logger("DB Context Manager")
+        # One shared logger, this class is instantiated for every statement
+        if CustomContextManager.class_logger is None:
+            CustomContextManager.class_logger = Logger("DB Context Manager")
 
     def __enter__(self):
         """
         Opens the connection.
         """
         self.conn = sqlite3.connect(self.name)
-        self.class_logger.logger.debug(f"Connected to '{self.name}' successfully.")
+        if self.class_logger.logger.isEnabledFor(logging.DEBUG):
+            self.class_logger.logger.debug("Connected to '%s' successfully.", self.name)
         return self.conn.cursor()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -29,7 +41,53 @@ class CustomContextManager:
         if self.conn:
             self.conn.commit()
             self.conn.close()
-            self.class_logger.logger.debug(f"Saved data and closed the connection to '{self.name}' successfully.")
+            if self.class_logger.logger.isEnabledFor(logging.DEBUG):
+                self.class_logger.logger.debug("Saved data and closed the connection to '%s' successfully.", self.name)
+
+
+class PersistentContextManager:
+    """
+    Context Manager Class running statements on a DB persistent connection, one immediate transaction
+    per outermost 'with' block, nested blocks join the running transaction.
+    """
+    def __init__(self, db):
+        """
+        Initializing the transaction.
+        :param db: For the DB owning the persistent connection.
+        """
+        self.db = db
+
+    def __enter__(self):
+        """
+        Locks the connection, and starts a transaction taking the write lock up front,
+        so a read followed by a write is never refused with 'database is locked' halfway.
+        """
+        self.db.lock.acquire()
+        try:
+            if self.db.depth == 0:
+                self.db.conn.execute("BEGIN IMMEDIATE")
+            self.db.depth += 1
+        except sqlite3.Error:
+            self.db.lock.release()
+            raise
+        return self.db.conn.cursor()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """
+        Commits the outermost transaction, or rolls it back on error, and unlocks the connection.
+        """
+        try:
+            self.db.depth -= 1
+            if self.db.depth == 0:
+                try:
+                    if exc_type is None:
+                        self.db.conn.execute("COMMIT")
+                finally:
+                    # Never leaves a failed transaction open for the next block
+                    if self.db.conn.in_transaction:
+                        self.db.conn.execute("ROLLBACK")
+        finally:
+            self.db.lock.release()
 
 
 class DB:
@@ -37,12 +95,47 @@ class DB:
     ServerDB class for creating and customize the server needed SQLite tables.
     DB is written with sql parameterized queries to prevent SQL Injection.
     """
-    def __init__(self, name: str):
+    def __init__(self, name: str, persistent: bool = False):
         """
         Class Constructor.
+        :param name: For the database file.
+        :param persistent: For keeping one WAL mode connection open for all the statements,
+                           instead of connecting for every statement.
         """
         self.name = name
         self.class_logger = Logger('DB')
+        self.conn = None
+        self.lock = RLock()
+        self.depth = 0
+        if persistent:
+            try:
+                self.conn = sqlite3.connect(name, timeout=30, isolation_level=None, check_same_thread=False)
+                self.conn.execute("PRAGMA journal_mode=WAL")
+                # WAL commits survive a process crash, only an OS crash may lose the last ones
+                self.conn.execute("PRAGMA synchronous=NORMAL")
+            except sqlite3.Error as err:
+                self.class_logger.logger.error(f"Error opening database {err}.")
+                if self.conn is not None:
+                    self.conn.close()
+                raise OpenError(f"[!] Unable to open database '{name}'.")
+
+    def transaction(self):
+        """
+        Gets the context manager to run statements with.
+        :return: A context manager giving a cursor.
+        """
+        if self.conn is not None:
+            return PersistentContextManager(self)
+        return CustomContextManager(self.name)
+
+    def close(self) -> None:
+        """
+        Closes the persistent connection, if any.
+        """
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
 
     def create_table(self, table_name: str, columns: str) -> None:
         """
@@ -51,13 +144,28 @@ class DB:
         :param columns: For the table columns.
         """
         try:
-            with CustomContextManager(self.name) as cur:
+            with self.transaction() as cur:
                 cur.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({columns})")
-                self.class_logger.logger.debug(f"Created Table '{table_name}' successfully.")
+                self.class_logger.logger.debug("Created Table '%s' successfully.", table_name)
         except sqlite3.Error as err:
             self.class_logger.logger.error(f"Error creating table {err}.")
             raise CreateTableError(f"[!] Unable to create table '{table_name}'.")
 
+    def create_index(self, index_name: str, table_name: str, columns: str) -> None:
+        """
+        Creates an index on a given table.
+        :param index_name: For the index name.
+        :param table_name: For the table to index.
+        :param columns: For the columns to index.
+        """
+        try:
+            with self.transaction() as cur:
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({columns})")
+                self.class_logger.logger.debug("Created Index '%s' successfully.", index_name)
+        except sqlite3.Error as err:
+            self.class_logger.logger.error(f"Error creating index {err}.")
+            raise CreateTableError(f"[!] Unable to create index '{index_name}'.")
+
     def insert_value(self, table_name: str, table_column: str, value: str) -> None:
         """
         Inserting a new value to a given database table.
@@ -66,13 +174,33 @@ class DB:
         :param value: For the value to insert.
         """
         try:
-            with CustomContextManager(self.name) as cur:
+            with self.transaction() as cur:
                 cur.execute(f"INSERT INTO {table_name} ({table_column}) VALUES(?)", (value,))
-                self.class_logger.logger.debug(f"Inserted '{value}' to '{table_name}' successfully.")
+                self.class_logger.logger.debug("Inserted '%s' to '%s' successfully.", value, table_name)
         except sqlite3.Error as err:
             self.class_logger.logger.error(f"Error inserting '{value}' to table {err}.")
             raise InsertError(f"[!] Unable to insert '{value}' to '{table_name}'.")
 
+    def insert_many(self, table_name: str, table_columns: str, rows: list, ignore_existing: bool = False) -> None:
+        """
+        Inserting several rows to a given database table in a single transaction.
+        :param table_name: For the table to insert values to.
+        :param table_columns: For the comma separated columns to insert values to.
+        :param rows: For the rows to insert.
+        :param ignore_existing: For skipping rows that conflict with a unique key instead of failing.
+        """
+        if not rows:
+            return None
+        placeholders = ', '.join('?' * len(rows[0]))
+        try:
+            with self.transaction() as cur:
+                cur.executemany(f"INSERT {'OR IGNORE ' if ignore_existing else ''}INTO {table_name} "
+                                f"({table_columns}) VALUES({placeholders})", rows)
+                self.class_logger.logger.debug("Inserted %s rows to '%s' successfully.", len(rows), table_name)
+        except sqlite3.Error as err:
+            self.class_logger.logger.error(f"Error inserting rows to table {err}.")
+            raise InsertError(f"[!] Unable to insert rows to '{table_name}'.")
+
     def insert_if_not_exists(self, table_name: str, table_column: str, value: str) -> bool:
         """
         Inserting a new value to a given database table only if it doesn't already exist.
@@ -82,7 +210,7 @@ class DB:
         :return: True if the value has been inserted successfully, False otherwise.
         """
         try:
-            with CustomContextManager(self.name) as cur:
+            with self.transaction() as cur:
                 cur.execute(f"SELECT * FROM {table_name} WHERE {table_column}=?", (value,))
                 result = cur.fetchone()
                 if result is None:
@@ -94,7 +222,7 @@ class DB:
                         self.class_logger.logger.error(f"[!] Unable to insert '{value}' to '{table_name}'.")
                         return False
                 else:
-                    self.class_logger.logger.debug(f"'{value}' Exists in '{table_name}'")
+                    self.class_logger.logger.debug("'%s' Exists in '%s'", value, table_name)
                     return False
         except sqlite3.Error as err:
             self.class_logger.logger.error(f"Error inserting '{value}' from '{table_name}' {err}.")
@@ -110,10 +238,11 @@ class DB:
         :param existing_value: For the existing table value.
         """
         try:
-            with CustomContextManager(self.name) as cur:
+            with self.transaction() as cur:
                 cur.execute(f"UPDATE {table_name} SET {column_to_update} = ? WHERE {current_table_column} = ?",
                                     (value, existing_value))
-                self.class_logger.logger.debug(f"Inserted '{value}' to '{column_to_update}' in '{table_name}' successfully.")
+                self.class_logger.logger.debug("Inserted '%s' to '%s' in '%s' successfully.", value, column_to_update,
+                                               table_name)
         except sqlite3.Error as err:
             self.class_logger.logger.error(f"Error updating table {err}.")
             raise UpdateError(f"[!] Unable to update '{value}' in '{table_name}'")
@@ -126,9 +255,9 @@ class DB:
         :param value_to_delete: For the value to delete.
         """
         try:
-            with CustomContextManager(self.name) as cur:
+            with self.transaction() as cur:
                 cur.execute(f"DELETE FROM {table_name} WHERE {table_column} = ?", (value_to_delete,))
-                self.class_logger.logger.debug(f"Deleted '{value_to_delete}' from '{table_name}' successfully.")
+                self.class_logger.logger.debug("Deleted '%s' from '%s' successfully.", value_to_delete, table_name)
         except sqlite3.Error as err:
             self.class_logger.logger.error(f"Error deleting values from '{table_name}' {err}.")
             raise DeleteError(f"[!] Unable to delete '{value_to_delete}' from '{table_name}'.")
@@ -141,7 +270,7 @@ class DB:
         :return: The table value after unpacking.
         """
         try:
-            with CustomContextManager(self.name) as cur:
+            with self.transaction() as cur:
                 cur.execute(f"SELECT {table_column} FROM {table_name}")
                 value = cur.fetchone()[0]
                 if value is None:
@@ -151,24 +280,551 @@ class DB:
         except sqlite3.Error as err:
             self.class_logger.logger.error(f"Error retrieving value from '{table_name}', Error: {err}.")
 
+    def select_existing(self, table_name: str, table_column: str, values: set) -> set:
+        """
+        Selects which of the given values already exist in a given table column.
+        :param table_name: For the table to select from.
+        :param table_column: For the table column to match.
+        :param values: For the values to look for.
+        :return: The subset of the values found in the table.
+        """
+        values = list(values)
+        found = set()
+        try:
+            with self.transaction() as cur:
+                # Batched to stay below the SQLite host parameters limit
+                for i in range(0, len(values), 500):
+                    batch = values[i:i + 500]
+                    cur.execute(f"SELECT {table_column} FROM {table_name} WHERE {table_column} "
+                                f"IN ({', '.join('?' * len(batch))})", batch)
+                    found.update(row[0] for row in cur.fetchall())
+            return found
+        except sqlite3.Error as err:
+            self.class_logger.logger.error(f"Error retrieving values from '{table_name}', Error: {err}.")
+            raise NotFoundError(f"[!] Unable to retrieve values from '{table_name}'.")
+
+    def select_row(self, table_name: str, table_column: str, value: str):
+        """
+        Selects the first table row matching a given value.
+        :param table_name: For the table to select from.
+        :param table_column: For the table column to match.
+        :param value: For the value to match.
+        :return: The matching row as a tuple, None if there is no such row.
+        """
+        try:
+            with self.transaction() as cur:
+                cur.execute(f"SELECT * FROM {table_name} WHERE {table_column} = ?", (value,))
+                return cur.fetchone()
+        except sqlite3.Error as err:
+            self.class_logger.logger.error(f"Error retrieving row from '{table_name}', Error: {err}.")
+            raise NotFoundError(f"[!] Unable to retrieve row from '{table_name}'.")
+
+    def replace_row(self, table_name: str, table_columns: str, values: tuple) -> None:
+        """
+        Inserts a new row, replacing an existing row with the same unique key.
+        :param table_name: For the table to insert the row to.
+        :param table_columns: For the comma separated columns to insert values to.
+        :param values: For the row values.
+        """
+        try:
+            with self.transaction() as cur:
+                cur.execute(f"INSERT OR REPLACE INTO {table_name} ({table_columns}) "
+                            f"VALUES({', '.join('?' * len(values))})", values)
+        except sqlite3.Error as err:
+            self.class_logger.logger.error(f"Error replacing row in '{table_name}' {err}.")
+            raise InsertError(f"[!] Unable to insert row to '{table_name}'.")
+
     def export_table_to_json(self, table_name: str) -> None:
         """
         Exports the given table data to a JSON file.
         :param table_name: For the table to export.
         """
         try:
-            with CustomContextManager(self.name) as cur:
-                cur.execute(f"SELECT * FROM {table_name}")
-                data = cur.fetchall()
-                if data is None:
-                    raise NotFoundError(f"[!] Unable to retrieve data from '{table_name}'.")
-                else:
-                    temp = json.dumps(data)
-                    with open(f"{self.name}.json", 'w') as out_file:
-                        out_file.write(temp)
-        except sqlite3.Error as err:
+            self.export_table(table_name, ExportFormats.JSON, f"{self.name}.json")
+        except ExportError as err:
             self.class_logger.logger.error(f"Error retrieving data from '{table_name}', Error: {err}.")
 
+    def has_monotonic_rowid(self, table_name: str) -> bool:
+        """
+        Checks whether a given table rowids only grow, SQLite reuses the highest rowid once its row is deleted
+        unless the table has an 'INTEGER PRIMARY KEY AUTOINCREMENT' column.
+        :param table_name: For the table to check.
+        :return: True if the table has an AUTOINCREMENT key, False otherwise.
+        """
+        try:
+            with self.transaction() as cur:
+                cur.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,))
+                row = cur.fetchone()
+        except sqlite3.Error as err:
+            self.class_logger.logger.error(f"Error reading '{table_name}' schema, Error: {err}.")
+            raise NotFoundError(f"[!] Unable to read '{table_name}' schema.")
+        return row is not None and 'AUTOINCREMENT' in row[0].upper()
+
+    def iterate_table(self, table_name: str, since_rowid: int = 0, batch_size: int = 10000):
+        """
+        Reads a given table in rowid order, one page at a time, on a separate read-only connection.
+        Every page is a new keyset query so no read lock is held between pages.
+        The rowid is only selected for paging, it is not part of the rows, even when a column is its alias.
+        :param table_name: For the table to read.
+        :param since_rowid: For the watermark, only rows with a greater rowid are returned.
+        :param batch_size: For the number of rows to read per page.
+        :return: A generator of (column names, rows page, last rowid of the page) tuples.
+        """
+        conn = sqlite3.connect(f"file:{self.name}?mode=ro", uri=True)
+        try:
+            cur = conn.cursor()
+            while True:
+                cur.execute(f"SELECT rowid, * FROM {table_name} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                            (since_rowid, batch_size))
+                rows = cur.fetchall()
+                if not rows:
+                    break
+                since_rowid = rows[-1][0]
+                yield [column[0] for column in cur.description[1:]], [row[1:] for row in rows], since_rowid
+        finally:
+            conn.close()
+
+    def export_table(self, table_name: str, file_format: str = None, out_file: str = None,
+                     compress: bool = False, since_rowid: int = 0, batch_size: int = 10000) -> int:
+        """
+        Streams the given table data to a file with constant memory use.
+        :param table_name: For the table to export.
+        :param file_format: For the export format, see ExportFormats, NDJSON as default.
+        :param out_file: For the output file, '<db name>.<format>[.gz]' as default.
+        :param compress: For writing the output as a gzip stream.
+        :param since_rowid: For incremental exports, only rows after this rowid watermark are exported,
+                            the table must have an AUTOINCREMENT key so no new row gets an exported rowid.
+        :param batch_size: For the number of rows to read and write at once.
+        :return: The rowid watermark to use for the next incremental export, None if the table rowids may be reused.
+        """
+        file_format = file_format or ExportFormats.NDJSON
+        if file_format not in (ExportFormats.JSON, ExportFormats.NDJSON, ExportFormats.CSV):
+            raise ExportError(f"[!] Unsupported export format '{file_format}'.")
+        try:
+            monotonic_rowid = self.has_monotonic_rowid(table_name)
+        except NotFoundError as err:
+            raise ExportError(err)
+        if since_rowid and not monotonic_rowid:
+            raise ExportError(f"[!] Unable to export '{table_name}' incrementally, "
+                              f"the table has no INTEGER PRIMARY KEY AUTOINCREMENT column.")
+        if out_file is None:
+            out_file = f"{self.name}.{file_format}{'.gz' if compress else ''}"
+        last_rowid = since_rowid
+        exported = 0
+        try:
+            if compress:
+                out = gzip.open(out_file, 'wt', encoding='utf-8', newline='')
+            else:
+                out = open(out_file, 'w', encoding='utf-8', newline='')
+            with out:
+                writer = csv.writer(out) if file_format == ExportFormats.CSV else None
+                if file_format == ExportFormats.JSON:
+                    out.write('[')
+                for columns, rows, last_rowid in self.iterate_table(table_name, since_rowid, batch_size):
+                    if file_format == ExportFormats.NDJSON:
+                        out.writelines(f"{json.dumps(dict(zip(columns, row)))}\n" for row in rows)
+                    elif file_format == ExportFormats.CSV:
+                        if exported == 0:
+                            writer.writerow(columns)
+                        writer.writerows(rows)
+                    else:
+                        # Same output as dumping the whole table at once
+                        out.write(f"{', ' if exported else ''}{', '.join(json.dumps(row) for row in rows)}")
+                    exported += len(rows)
+                if file_format == ExportFormats.JSON:
+                    out.write(']')
+        except (sqlite3.Error, OSError) as err:
+            self.class_logger.logger.error(f"Error exporting '{table_name}' to '{out_file}', Error: {err}.")
+            raise ExportError(f"[!] Unable to export '{table_name}' to '{out_file}'.")
+        if not monotonic_rowid:
+            last_rowid = None
+        self.class_logger.logger.info("Exported %s rows from '%s' to '%s', watermark is %s.", exported, table_name,
+                                      out_file, last_rowid)
+        return last_rowid
+
+
+"""
+Auxiliary class for supported export formats.
+"""
+
+
+class ExportFormats:
+    JSON = 'json'
+    NDJSON = 'ndjson'
+    CSV = 'csv'
+
+
+class DBShard:
+    """
+    A single shard SQLite file with its own persistent WAL mode connection, owned by one writer thread.
+    The writer group commits the queued operations, every operation inside its own savepoint
+    so a failing operation does not roll back the others.
+    """
+    def __init__(self, name: str, writer_batch: int):
+        """
+        Class Constructor.
+        :param name: For the shard database file.
+        :param writer_batch: For the maximal number of queued operations committed together.
+        """
+        self.name = name
+        self.writer_batch = writer_batch
+        self.class_logger = Logger('DBShard')
+        # Opened here so an unusable shard fails the caller right away
+        self.db = DB(name, persistent=True)
+        self.queue = queue.Queue()
+        self.lock = Lock()
+        self.running = True
+        self.commits = 0
+        self.operations = 0
+        self.writer = Thread(target=self.run_writer, name=f"DBShard {name}", daemon=True)
+        self.writer.start()
+
+    def submit(self, operation):
+        """
+        Runs a given operation on the shard writer thread and waits for its result.
+        :param operation: For a callable getting the shard cursor.
+        :return: The operation return value.
+        """
+        future = Future()
+        with self.lock:
+            if not self.running:
+                raise ShardError(f"[!] Shard '{self.name}' writer is not running.")
+            self.queue.put((operation, future))
+        return future.result()
+
+    def close(self) -> None:
+        """
+        Stops the writer thread after the queued operations and closes the shard connection.
+        """
+        with self.lock:
+            if self.running:
+                self.queue.put(None)
+        self.writer.join()
+        self.db.close()
+
+    def commit_batch(self, batch: list) -> None:
+        """
+        Runs a batch of operations in one transaction, the results are only handed out once committed.
+        :param batch: For the (operation, future) list.
+        """
+        results = []
+        try:
+            with self.db.transaction() as cur:
+                for operation, future in batch:
+                    cur.execute("SAVEPOINT operation")
+                    try:
+                        results.append((future, operation(cur), None))
+                        cur.execute("RELEASE operation")
+                    except Exception as err:
+                        cur.execute("ROLLBACK TO operation")
+                        cur.execute("RELEASE operation")
+                        results.append((future, None, err))
+        except sqlite3.Error as err:
+            self.class_logger.logger.error("Unable to commit %s operations to '%s', Error: %s.", len(batch),
+                                           self.name, err)
+            results = [(future, None, err) for _, future in batch]
+        self.commits += 1
+        self.operations += len(batch)
+        for future, result, err in results:
+            if err is None:
+                future.set_result(result)
+            else:
+                future.set_exception(err)
+
+    def run_writer(self) -> None:
+        """
+        Writer thread loop, commits whatever was queued meanwhile as one batch until a None operation is queued.
+        """
+        batch = []
+        try:
+            running = True
+            while running:
+                batch = [self.queue.get()]
+                while len(batch) < self.writer_batch:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in batch:
+                    running = False
+                    batch = [item for item in batch if item is not None]
+                if batch:
+                    self.commit_batch(batch)
+                batch = []
+        except BaseException as err:
+            self.class_logger.logger.error("Shard '%s' writer stopped, Error: %s.", self.name, err)
+            raise
+        finally:
+            # Nothing is queued once stopped, every waiting caller gets an error instead of waiting forever
+            with self.lock:
+                self.running = False
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for item in batch:
+                if item is not None and not item[1].done():
+                    item[1].set_exception(ShardError(f"[!] Shard '{self.name}' writer stopped."))
+
+
+class ShardedDB(DB):
+    """
+    DB splitting one hash table across several SQLite files by digest prefix, so consumer processes
+    claiming different digests do not wait for one write lock. Operations matching the hash column are routed
+    to the owning shard, other operations on the hash table go to all the shards, and the other tables
+    stay in the main database file.
+    """
+    def __init__(self, name: str, shard_count: int, persistent: bool = False, table_name: str = 'Files',
+                 hash_column: str = 'File_Hash', writer_batch: int = 256):
+        """
+        Class Constructor.
+        :param name: For the main database file, shards are named '<name>_shard<index>'.
+        :param shard_count: For the number of shards.
+        :param persistent: For keeping a persistent WAL mode connection to the main database file.
+        :param table_name: For the sharded hash table.
+        :param hash_column: For the md5 hex digest column used for routing.
+        :param writer_batch: For the maximal number of operations committed together by a shard writer.
+        """
+        super().__init__(name, persistent)
+        self.table_name = table_name
+        self.hash_column = hash_column
+        self.shards = []
+        try:
+            for index in range(shard_count):
+                self.shards.append(DBShard(f"{name}_shard{index}", writer_batch))
+        except OpenError:
+            self.close()
+            raise
+
+    def get_shard(self, digest: str) -> DBShard:
+        """
+        Gets the shard owning a given digest.
+        :param digest: For the md5 hex digest.
+        :return: The owning shard.
+        """
+        try:
+            prefix = int(digest[:8], 16)
+        except (TypeError, ValueError):
+            prefix = zlib.crc32(str(digest).encode())
+        return self.shards[prefix % len(self.shards)]
+
+    def run_on_shards(self, table_column: str, value: str, operation) -> list:
+        """
+        Runs an operation on the shard owning a value, or on all the shards for the other columns.
+        :param table_column: For the column the value belongs to.
+        :param value: For the value.
+        :param operation: For a callable getting the shard cursor.
+        :return: The operation results.
+        """
+        if table_column == self.hash_column:
+            return [self.get_shard(value).submit(operation)]
+        return [shard.submit(operation) for shard in self.shards]
+
+    def close(self) -> None:
+        """
+        Stops all the shard writers and closes the main database connection.
+        """
+        for shard in self.shards:
+            shard.close()
+        super().close()
+
+    def create_table(self, table_name: str, columns: str) -> None:
+        """
+        Creates a table, the hash table is created in every shard with an index on the hash column.
+        """
+        if table_name != self.table_name:
+            return super().create_table(table_name, columns)
+
+        def operation(cur):
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({columns})")
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {table_name}_{self.hash_column} "
+                        f"ON {table_name} ({self.hash_column})")
+        try:
+            for shard in self.shards:
+                shard.submit(operation)
+        except (sqlite3.Error, ShardError) as err:
+            self.class_logger.logger.error(f"Error creating table {err}.")
+            raise CreateTableError(f"[!] Unable to create table '{table_name}'.")
+
+    def insert_value(self, table_name: str, table_column: str, value: str) -> None:
+        """
+        Inserts a value, hash values to their owning shard, see DB.insert_value.
+        """
+        if table_name != self.table_name:
+            return super().insert_value(table_name, table_column, value)
+        if table_column != self.hash_column:
+            raise InsertError(f"[!] Unable to insert '{value}' to '{table_name}' without its '{self.hash_column}'.")
+
+        def operation(cur):
+            cur.execute(f"INSERT INTO {table_name} ({table_column}) VALUES(?)", (value,))
+        try:
+            self.get_shard(value).submit(operation)
+        except (sqlite3.Error, ShardError) as err:
+            self.class_logger.logger.error(f"Error inserting '{value}' to table {err}.")
+            raise InsertError(f"[!] Unable to insert '{value}' to '{table_name}'.")
+
+    def insert_many(self, table_name: str, table_columns: str, rows: list, ignore_existing: bool = False) -> None:
+        """
+        Inserts rows, every row to the shard owning its hash, see DB.insert_many.
+        """
+        if table_name != self.table_name:
+            return super().insert_many(table_name, table_columns, rows, ignore_existing)
+        columns = [column.strip() for column in table_columns.split(',')]
+        if self.hash_column not in columns:
+            raise InsertError(f"[!] Unable to insert rows to '{table_name}' without their '{self.hash_column}'.")
+        hash_index = columns.index(self.hash_column)
+        by_shard = {}
+        for row in rows:
+            by_shard.setdefault(self.get_shard(row[hash_index]), []).append(row)
+        try:
+            for shard, shard_rows in by_shard.items():
+                shard.submit(lambda cur, shard_rows=shard_rows: cur.executemany(
+                    f"INSERT {'OR IGNORE ' if ignore_existing else ''}INTO {table_name} ({table_columns}) "
+                    f"VALUES({', '.join('?' * len(columns))})", shard_rows))
+        except (sqlite3.Error, ShardError) as err:
+            self.class_logger.logger.error(f"Error inserting rows to table {err}.")
+            raise InsertError(f"[!] Unable to insert rows to '{table_name}'.")
+
+    def insert_if_not_exists(self, table_name: str, table_column: str, value: str) -> bool:
+        """
+        Atomically claims a hash value in its owning shard, see DB.insert_if_not_exists.
+        """
+        if table_name != self.table_name or table_column != self.hash_column:
+            return super().insert_if_not_exists(table_name, table_column, value)
+
+        def operation(cur):
+            cur.execute(f"SELECT 1 FROM {table_name} WHERE {table_column} = ? LIMIT 1", (value,))
+            if cur.fetchone() is not None:
+                return False
+            cur.execute(f"INSERT INTO {table_name} ({table_column}) VALUES(?)", (value,))
+            return True
+        try:
+            return self.get_shard(value).submit(operation)
+        except (sqlite3.Error, ShardError) as err:
+            self.class_logger.logger.error(f"Error inserting '{value}' from '{table_name}' {err}.")
+
+    def update_table(self, table_name: str, column_to_update: str, value: str, current_table_column: str,
+                     existing_value: str) -> None:
+        """
+        Updates the rows matching a value, see DB.update_table.
+        """
+        if table_name != self.table_name:
+            return super().update_table(table_name, column_to_update, value, current_table_column, existing_value)
+        if column_to_update == self.hash_column:
+            # Would move the rows to another shard
+            raise UpdateError(f"[!] Unable to update '{self.hash_column}' in '{table_name}'.")
+
+        def operation(cur):
+            cur.execute(f"UPDATE {table_name} SET {column_to_update} = ? WHERE {current_table_column} = ?",
+                        (value, existing_value))
+        try:
+            self.run_on_shards(current_table_column, existing_value, operation)
+        except (sqlite3.Error, ShardError) as err:
+            self.class_logger.logger.error(f"Error updating table {err}.")
+            raise UpdateError(f"[!] Unable to update '{value}' in '{table_name}'")
+
+    def delete_value(self, table_name: str, table_column: str, value_to_delete: str) -> None:
+        """
+        Deletes the rows matching a value, see DB.delete_value.
+        """
+        if table_name != self.table_name:
+            return super().delete_value(table_name, table_column, value_to_delete)
+
+        def operation(cur):
+            cur.execute(f"DELETE FROM {table_name} WHERE {table_column} = ?", (value_to_delete,))
+        try:
+            self.run_on_shards(table_column, value_to_delete, operation)
+        except (sqlite3.Error, ShardError) as err:
+            self.class_logger.logger.error(f"Error deleting values from '{table_name}' {err}.")
+            raise DeleteError(f"[!] Unable to delete '{value_to_delete}' from '{table_name}'.")
+
+    def select_existing(self, table_name: str, table_column: str, values: set) -> set:
+        """
+        Selects which of the given values already exist, hash values from their owning shards,
+        see DB.select_existing.
+        """
+        if table_name != self.table_name:
+            return super().select_existing(table_name, table_column, values)
+        if table_column == self.hash_column:
+            by_shard = {}
+            for value in values:
+                by_shard.setdefault(self.get_shard(value), []).append(value)
+        else:
+            by_shard = {shard: list(values) for shard in self.shards}
+
+        def operation(cur, shard_values):
+            found = set()
+            for i in range(0, len(shard_values), 500):
+                batch = shard_values[i:i + 500]
+                cur.execute(f"SELECT {table_column} FROM {table_name} WHERE {table_column} "
+                            f"IN ({', '.join('?' * len(batch))})", batch)
+                found.update(row[0] for row in cur.fetchall())
+            return found
+        found = set()
+        try:
+            for shard, shard_values in by_shard.items():
+                found |= shard.submit(lambda cur, shard_values=shard_values: operation(cur, shard_values))
+        except (sqlite3.Error, ShardError) as err:
+            self.class_logger.logger.error(f"Error retrieving values from '{table_name}', Error: {err}.")
+            raise NotFoundError(f"[!] Unable to retrieve values from '{table_name}'.")
+        return found
+
+    def select_row(self, table_name: str, table_column: str, value: str):
+        """
+        Selects the first row matching a value, see DB.select_row.
+        """
+        if table_name != self.table_name:
+            return super().select_row(table_name, table_column, value)
+
+        def operation(cur):
+            cur.execute(f"SELECT * FROM {table_name} WHERE {table_column} = ?", (value,))
+            return cur.fetchone()
+        try:
+            rows = self.run_on_shards(table_column, value, operation)
+        except (sqlite3.Error, ShardError) as err:
+            self.class_logger.logger.error(f"Error retrieving row from '{table_name}', Error: {err}.")
+            raise NotFoundError(f"[!] Unable to retrieve row from '{table_name}'.")
+        return next((row for row in rows if row is not None), None)
+
+    def has_monotonic_rowid(self, table_name: str) -> bool:
+        """
+        Checks whether a given table rowids only grow, see DB.has_monotonic_rowid.
+        The hash table rowids are per shard, so they never make a single watermark.
+        """
+        if table_name == self.table_name:
+            return False
+        return super().has_monotonic_rowid(table_name)
+
+    def iterate_table(self, table_name: str, since_rowid: int = 0, batch_size: int = 10000):
+        """
+        Reads a table, the hash table one shard after the other, see DB.iterate_table.
+        """
+        if table_name != self.table_name:
+            yield from super().iterate_table(table_name, since_rowid, batch_size)
+            return None
+        for shard in self.shards:
+            yield from shard.db.iterate_table(table_name, since_rowid, batch_size)
+
+    def reshard(self, source: DB) -> int:
+        """
+        Copies the hash table of an existing database, plain or sharded, into this database shards.
+        :param source: For the database to copy from.
+        :return: The number of copied rows.
+        """
+        # The integer key is per shard, every copied row gets a new one from its target shard
+        key_columns = {row[1] for row in self.shards[0].submit(
+            lambda cur: cur.execute(f"PRAGMA table_info({self.table_name})").fetchall())
+            if row[5] and row[2].upper() == 'INTEGER'}
+        copied = 0
+        for columns, rows, _ in source.iterate_table(self.table_name):
+            kept = [index for index, column in enumerate(columns) if column not in key_columns]
+            self.insert_many(self.table_name, ', '.join(columns[index] for index in kept),
+                             [tuple(row[index] for index in kept) for row in rows])
+            copied += len(rows)
+        self.class_logger.logger.info("Resharded %s rows into %s shards.", copied, len(self.shards))
+        return copied
+
 
 """
 Custom Exception Classes for raising high-level Exceptions,
@@ -176,6 +832,10 @@ and make DB error handling more informative.
 """
 
 
+class OpenError(Exception):
+    pass
+
+
 class NotFoundError(Exception):
     pass
 
@@ -195,3 +855,10 @@ class UpdateError(Exception):
 class DeleteError(Exception):
     pass
 
+
+class ExportError(Exception):
+    pass
+
+
+class ShardError(Exception):
+    pass
@@ -0,0 +1,135 @@
+"""
+Consumer database tools:
+1. 'reshard <shard count> [<current shard count>]' copies the consumer hash table into a new number of shards,
+   the current database is read as a plain database when no current shard count is given.
+2. 'benchmark' measures the claims throughput of several consumer processes sharing a plain database,
+   with a connection per statement or a persistent WAL mode connection, and several shard counts.
+"""
+import os
+import sys
+import tempfile
+import time
+import uuid
+import hashlib
+from multiprocessing import Pool
+from threading import Thread
+from database import DB, ShardedDB
+from config_parser import get_configuration
+
+
+DATABASE_NAME = str(get_configuration("consumer_database_name"))
+WRITER_BATCH = int(get_configuration("writer_batch", "sharding"))
+FILES_COLUMNS = 'File_Name, File_Hash, File_Id INTEGER PRIMARY KEY AUTOINCREMENT'
+BENCHMARK_WORKERS = 4
+BENCHMARK_THREADS = 4
+BENCHMARK_CLAIMS = 250
+
+
+def open_db(db_name: str, shard_count: int, persistent: bool) -> DB:
+    """
+    Opens a plain or a sharded database.
+    :param db_name: For the database name.
+    :param shard_count: For the number of shards, 0 for a plain database.
+    :param persistent: For using a persistent WAL mode connection to the main database file.
+    :return: The database.
+    """
+    if shard_count:
+        return ShardedDB(db_name, shard_count, persistent, writer_batch=WRITER_BATCH)
+    return DB(db_name, persistent)
+
+
+def reshard(shard_count: int, current_shard_count: int = 0) -> None:
+    """
+    Copies the consumer hash table into '<name>_resharded' shards, to be renamed once checked.
+    :param shard_count: For the new number of shards.
+    :param current_shard_count: For the current number of shards, 0 for a plain database.
+    """
+    source = open_db(DATABASE_NAME, current_shard_count, False)
+    target = ShardedDB(f"{DATABASE_NAME}_resharded", shard_count, writer_batch=WRITER_BATCH)
+    target.create_table('Files', FILES_COLUMNS)
+    start_time = time.perf_counter()
+    copied = target.reshard(source)
+    print(f"[+] Copied {copied} rows into {shard_count} shards in {time.perf_counter() - start_time:.2f} seconds, "
+          f"see '{DATABASE_NAME}_resharded_shard<index>'.")
+    target.close()
+    source.close()
+
+
+def claim_digests(db_name: str, shard_count: int, persistent: bool) -> tuple:
+    """
+    Claims random digests the way a consumer process does, from several threads sharing the database.
+    :param db_name: For the database name.
+    :param shard_count: For the number of shards, 0 for a plain database.
+    :param persistent: For using a persistent WAL mode connection to the main database file.
+    :return: The number of failed claims, shard commits and shard operations.
+    """
+    db = open_db(db_name, shard_count, persistent)
+    failed = []
+
+    def claim():
+        for _ in range(BENCHMARK_CLAIMS):
+            file_hash = hashlib.md5(uuid.uuid4().bytes).hexdigest()
+            # None is returned when the claim failed, e.g. with 'database is locked'
+            if db.insert_if_not_exists('Files', 'File_Hash', file_hash) is None:
+                failed.append(file_hash)
+            else:
+                db.update_table('Files', 'File_Name', file_hash, 'File_Hash', file_hash)
+    threads = [Thread(target=claim) for _ in range(BENCHMARK_THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    shards = db.shards if shard_count else []
+    db.close()
+    return len(failed), sum(shard.commits for shard in shards), sum(shard.operations for shard in shards)
+
+
+def run_claims(db_name: str, shard_count: int, persistent: bool) -> tuple:
+    """
+    Claims random digests from several processes sharing the database.
+    :param db_name: For the database name.
+    :param shard_count: For the number of shards, 0 for a plain database.
+    :param persistent: For using a persistent WAL mode connection to the main database file.
+    :return: The claims per second, the number of failed claims and the average shard commit size.
+    """
+    db = open_db(db_name, shard_count, persistent)
+    db.create_table('Files', FILES_COLUMNS)
+    db.close()
+    start_time = time.perf_counter()
+    with Pool(BENCHMARK_WORKERS) as pool:
+        results = pool.starmap(claim_digests, [(db_name, shard_count, persistent)] * BENCHMARK_WORKERS)
+    claims_rate = BENCHMARK_WORKERS * BENCHMARK_THREADS * BENCHMARK_CLAIMS / (time.perf_counter() - start_time)
+    commits = sum(result[1] for result in results)
+    return claims_rate, sum(result[0] for result in results), sum(result[2] for result in results) / (commits or 1)
+
+
+def benchmark() -> None:
+    """
+    Compares the claims throughput of a plain database with 1, 2, 4 and 8 shards.
+    """
+    print(f"[+] Benchmarking {BENCHMARK_WORKERS} processes of {BENCHMARK_THREADS} threads "
+          f"claiming {BENCHMARK_CLAIMS} digests each...")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for persistent, label in ((False, 'connection per statement'), (True, 'persistent WAL connection')):
+            claims_rate, failed, _ = run_claims(os.path.join(temp_dir, f"DB_{label.split()[0]}"), 0, persistent)
+            print(f"   - {label:<26} {claims_rate:8.0f} claims/s, {failed} failed claims")
+        for shard_count in (1, 2, 4, 8):
+            claims_rate, failed, commit_size = run_claims(os.path.join(temp_dir, f"Sharded_DB_{shard_count}"),
+                                                          shard_count, False)
+            label = f"{shard_count} shards"
+            print(f"   - {label:<26} {claims_rate:8.0f} claims/s, {failed} failed claims, "
+                  f"{commit_size:.1f} operations per commit")
+
+
+def db_tools_main():
+
+    if len(sys.argv) >= 3 and sys.argv[1] == 'reshard':
+        reshard(int(sys.argv[2]), int(sys.argv[3]) if len(sys.argv) > 3 else 0)
+    elif len(sys.argv) == 2 and sys.argv[1] == 'benchmark':
+        benchmark()
+    else:
+        print("[!] Usage: python db_tools.py reshard <shard count> [<current shard count>] | benchmark")
+
+
+if __name__ == "__main__":
+    db_tools_main()
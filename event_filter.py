@@ -0,0 +1,121 @@
+"""
+Event Filter Class for rejecting unwanted file events in the watcher, before they are published to RabbitMQ.
+"""
+import fnmatch
+import os
+import re
+from threading import Lock
+from config_parser import get_configuration
+
+
+class FilterRules:
+    EXCLUDED_DIR = 'excluded_dir'
+    EXCLUDE_GLOB = 'exclude_glob'
+    EXCLUDE_REGEX = 'exclude_regex'
+    EXTENSION = 'extension'
+    INCLUDE = 'include'
+    MIN_SIZE = 'min_size'
+    MAX_SIZE = 'max_size'
+    ACCEPTED = 'accepted'
+
+
+class EventFilter:
+
+    def __init__(self, excluded_dirs: tuple = ()):
+        """
+        Class Constructor.
+        Compiles the configured rules once:
+        1. supported file extensions set.
+        2. include and exclude glob and regex lists, each combined into a single pattern.
+        3. excluded subtrees.
+        4. min and max file size, 0 to disable.
+        :param excluded_dirs: For subtrees to exclude on top of the configured ones.
+        """
+        self.file_types = frozenset(get_configuration("file_types"))
+        self.excluded_dirs = tuple(os.path.join(os.path.abspath(path), '')
+                                   for path in (*get_configuration("excluded_dirs", "watcher_filter"), *excluded_dirs))
+        self.exclude_glob = self.compile_globs(get_configuration("exclude_globs", "watcher_filter"))
+        self.exclude_regex = self.compile_regexes(get_configuration("exclude_regexes", "watcher_filter"))
+        self.include_glob = self.compile_globs(get_configuration("include_globs", "watcher_filter"))
+        self.include_regex = self.compile_regexes(get_configuration("include_regexes", "watcher_filter"))
+        self.min_size = int(get_configuration("min_size", "watcher_filter"))
+        self.max_size = int(get_configuration("max_size", "watcher_filter"))
+        self.lock = Lock()
+        self.counters = {rule: 0 for key, rule in vars(FilterRules).items() if key.isupper()}
+
+    @staticmethod
+    def compile_globs(globs: list):
+        """
+        Combines a list of file name glob patterns into one compiled pattern.
+        :param globs: For the glob patterns.
+        :return: The compiled pattern, None if the list is empty.
+        """
+        if not globs:
+            return None
+        return re.compile('|'.join(fnmatch.translate(glob) for glob in globs))
+
+    @staticmethod
+    def compile_regexes(regexes: list):
+        """
+        Combines a list of full path regular expressions into one compiled pattern.
+        :param regexes: For the regular expressions.
+        :return: The compiled pattern, None if the list is empty.
+        """
+        if not regexes:
+            return None
+        return re.compile('|'.join(f"(?:{regex})" for regex in regexes))
+
+    def check(self, event_type: str, path: str) -> str:
+        """
+        Runs a given event path through the rules, cheapest rules first.
+        :param event_type: For the event type, size rules only apply to modified events,
+                           inotify reports created files before any byte is written.
+        :param path: For the event file path.
+        :return: The name of the rule that rejected the event, 'accepted' otherwise.
+        """
+        if self.excluded_dirs and path.startswith(self.excluded_dirs):
+            return FilterRules.EXCLUDED_DIR
+        file_name = os.path.basename(path)
+        if self.exclude_glob is not None and self.exclude_glob.match(file_name):
+            return FilterRules.EXCLUDE_GLOB
+        if self.exclude_regex is not None and self.exclude_regex.search(path):
+            return FilterRules.EXCLUDE_REGEX
+        if self.file_types:
+            # Same as pathlib.Path(path).suffix used by the consumer
+            dot = file_name.rfind('.')
+            if not 0 < dot < len(file_name) - 1 or file_name[dot:] not in self.file_types:
+                return FilterRules.EXTENSION
+        if (self.include_glob is not None or self.include_regex is not None) \
+                and not (self.include_glob is not None and self.include_glob.match(file_name)) \
+                and not (self.include_regex is not None and self.include_regex.search(path)):
+            return FilterRules.INCLUDE
+        if (self.min_size or self.max_size) and event_type == 'modified':
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                return FilterRules.ACCEPTED
+            if size < self.min_size:
+                return FilterRules.MIN_SIZE
+            if self.max_size and size > self.max_size:
+                return FilterRules.MAX_SIZE
+        return FilterRules.ACCEPTED
+
+    def accept(self, event_type: str, path: str) -> bool:
+        """
+        Checks a given event and counts the rule hit.
+        :param event_type: For the event type.
+        :param path: For the event file path.
+        :return: True if the event should be published, False otherwise.
+        """
+        rule = self.check(event_type, path)
+        with self.lock:
+            self.counters[rule] += 1
+        return rule == FilterRules.ACCEPTED
+
+    def get_counters(self) -> dict:
+        """
+        Gets the per rule hit counters.
+        :return: A copy of the counters.
+        """
+        with self.lock:
+            return dict(self.counters)
@@ -5,7 +5,9 @@ import sys
 from time import sleep
 from threading import Thread
 from consumer import Consumer
-from watchdog.observers import Observer
+from profiler import Profiler
+from recorder import EventRecorder
+from root_watcher import WatchedRoot
 from watcher import FileChangeWatcher
 from logger import Logger
 from config_parser import get_configuration
@@ -21,25 +23,68 @@ class FileHandler(Thread):
         self.host = host
         self.threads = []
         self.class_logger = Logger('FileHandler')
-        self.observer = Observer()
+        self.roots = []
+        self.recorder = None
+        if str(get_configuration("enabled", "recorder")) == "true":
+            self.recorder = EventRecorder(str(get_configuration("file_name", "recorder")),
+                                          int(get_configuration("flush_every", "recorder")),
+                                          float(get_configuration("flush_interval", "recorder")))
+            # From the constructor as well, the recording must be completed on termination
+            self.recorder.install_signal_handler()
         self.SOURCE_DIR = str(get_configuration("watcher_source_dir"))
-        self.consumer = Consumer(self.host)
+        self.profiler = Profiler()
+        # Started from the constructor, signal handlers can only be installed from the main thread
+        self.profiler.start()
+        self.consumer = Consumer(self.host, self.profiler)
+
+    def setup_roots(self) -> None:
+        """
+        Creates a watched root with its own observer and event handler for every configured root,
+        the 'watcher_source_dir' is watched when no roots are configured.
+        """
+        roots = get_configuration("watcher_roots") or [{"path": self.SOURCE_DIR}]
+        mode = str(get_configuration("mode", "watcher"))
+        poll_interval = float(get_configuration("poll_interval", "watcher"))
+        scan_workers = int(get_configuration("scan_workers", "watcher"))
+        for root in roots:
+            excluded_dirs = root.get("excluded_dirs", [])
+            watched_root = WatchedRoot(root["path"], excluded_dirs, root.get("mode", mode), None, poll_interval,
+                                       scan_workers)
+            watched_root.event_handler = FileChangeWatcher(self.host, watched_root.excluded_dirs, self.recorder)
+            self.roots.append(watched_root)
 
     def start_observer(self) -> None:
         """
         Starts watcher.
         """
         self.consumer.connect()
-        self.observer.start()
-        print(f"[+] Started File Handler, observing the directory '{self.SOURCE_DIR}'.")
+        for root in self.roots:
+            root.start()
+            self.threads.append(root.observer)
+            publisher_thread = root.event_handler.producer.publisher_thread
+            if publisher_thread is None:
+                # Without backpressure the observer thread publishes the events itself
+                self.profiler.track_thread(f"observer/publisher {root.path}", root.observer)
+            else:
+                self.profiler.track_thread(f"observer {root.path}", root.observer)
+                self.profiler.track_thread(f"publisher {root.path}", publisher_thread)
+            for emitter in getattr(root.observer, 'emitters', ()):
+                self.profiler.track_thread(f"emitter {emitter.watch.path}", emitter)
+        print(f"[+] Started File Handler, observing {len(self.roots)} directories.")
         self.class_logger.logger.info(f"File Handler has been started successfully.")
 
     def stop_observer(self) -> None:
         """
         Stopes watcher.
         """
-        self.observer.stop()
+        for root in self.roots:
+            root.stop()
+            self.class_logger.logger.info("Watcher filter counters of '%s': %s", root.path,
+                                          root.event_handler.event_filter.get_counters())
+        if self.recorder is not None:
+            self.recorder.close()
         self.consumer.close_connection()
+        self.profiler.stop()
         print("[+] Stopped File Handler.")
         self.class_logger.logger.info(f"File Handler has been stopped successfully.")
 
@@ -47,13 +92,12 @@ class FileHandler(Thread):
         """
         FileHandler run method to enable project logic using threads.
         """
-        event_handler = FileChangeWatcher(self.host)
-        self.observer.schedule(event_handler, self.SOURCE_DIR, recursive=True)
-        self.threads.append(self.observer)
+        self.setup_roots()
         self.start_observer()
         consumer_thread = Thread(target=self.consumer.run)
         self.threads.append(consumer_thread)
         consumer_thread.start()
+        self.profiler.track_thread('consumer', consumer_thread)
 
         try:
             while True:
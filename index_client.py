@@ -0,0 +1,242 @@
+"""
+Dedup Index Client Class for talking to the shared dedup index service, see index_service.py.
+
+Binary protocol, every request and response starts with a fixed header:
+1. request: request id (uint32), operation (uint8), entries count (uint16), payload length (uint32),
+   followed by the entries, each one a raw md5 digest (16 bytes), a name length (uint16) and the utf-8 name.
+2. response: request id (uint32), status (uint8), entries count (uint16),
+   followed by one result byte per entry.
+"""
+import hashlib
+import queue
+import socket
+import struct
+from itertools import count
+from threading import Lock
+
+
+REQUEST_HEADER = struct.Struct('!IBHI')
+RESPONSE_HEADER = struct.Struct('!IBH')
+ENTRY_HEADER = struct.Struct('!H')
+DIGEST_SIZE = hashlib.md5().digest_size
+MAX_ENTRIES = 65535
+
+
+class IndexOperations:
+    LOOKUP = 1
+    CLAIM = 2
+    RELEASE = 3
+
+
+class IndexStatus:
+    OK = 0
+    ERROR = 1
+
+
+def encode_request(request_id: int, operation: int, entries: list) -> bytes:
+    """
+    Encodes a request frame.
+    :param request_id: For the request id echoed back in the response.
+    :param operation: For the operation, see IndexOperations.
+    :param entries: For the (digest hex string, name) entries.
+    :return: The encoded frame.
+    """
+    payload = bytearray()
+    for digest, name in entries:
+        encoded_name = name.encode() if name else b''
+        payload += bytes.fromhex(digest)
+        payload += ENTRY_HEADER.pack(len(encoded_name))
+        payload += encoded_name
+    return REQUEST_HEADER.pack(request_id, operation, len(entries), len(payload)) + payload
+
+
+def decode_entries(payload: bytes, entries_count: int) -> list:
+    """
+    Decodes the entries of a request payload.
+    :param payload: For the request payload.
+    :param entries_count: For the number of entries in the payload.
+    :return: The (raw digest, name) entries.
+    """
+    entries = []
+    offset = 0
+    for _ in range(entries_count):
+        digest = bytes(payload[offset:offset + DIGEST_SIZE])
+        offset += DIGEST_SIZE
+        name_length, = ENTRY_HEADER.unpack_from(payload, offset)
+        offset += ENTRY_HEADER.size
+        entries.append((digest, bytes(payload[offset:offset + name_length]).decode()))
+        offset += name_length
+    return entries
+
+
+class DedupIndexClient:
+
+    def __init__(self, host: str, port: int, unix_socket: str = None, pool_size: int = 4, timeout: float = 10):
+        """
+        Class Constructor.
+        :param host: For the service host, used when no unix socket is given.
+        :param port: For the service port.
+        :param unix_socket: For the service unix socket path, None to use TCP.
+        :param pool_size: For the maximal number of idle connections kept open.
+        :param timeout: For the socket timeout in seconds.
+        """
+        self.host = host
+        self.port = port
+        self.unix_socket = unix_socket
+        self.timeout = timeout
+        self.pool = queue.LifoQueue(pool_size)
+        self.request_ids = count(1)
+        self.ids_lock = Lock()
+
+    def open_connection(self) -> socket.socket:
+        """
+        Opens a new connection to the service.
+        :return: The connected socket.
+        """
+        if self.unix_socket:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.settimeout(self.timeout)
+            conn.connect(self.unix_socket)
+        else:
+            conn = socket.create_connection((self.host, self.port), self.timeout)
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn
+
+    def acquire(self) -> tuple:
+        """
+        Takes an idle pooled connection or opens a new one.
+        :return: The connected socket, and whether it was pooled.
+        """
+        try:
+            return self.pool.get_nowait(), True
+        except queue.Empty:
+            return self.open_connection(), False
+
+    def release_connection(self, conn: socket.socket) -> None:
+        """
+        Returns a connection to the pool, closing it if the pool is full.
+        :param conn: For the connection to return.
+        """
+        try:
+            self.pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self) -> None:
+        """
+        Closes all the pooled connections.
+        """
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    @staticmethod
+    def receive_exactly(conn: socket.socket, size: int) -> bytes:
+        """
+        Receives an exact number of bytes.
+        :param conn: For the connection to read from.
+        :param size: For the number of bytes to read.
+        :return: The received bytes.
+        """
+        data = bytearray()
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("[!] Dedup index service closed the connection.")
+            data += chunk
+        return bytes(data)
+
+    def exchange(self, conn: socket.socket, frames: list, request_ids: list) -> dict:
+        """
+        Sends the request frames on a given connection and reads their responses.
+        The connection is closed on any error, unread responses would be mixed into the next request.
+        :param conn: For the connection to use.
+        :param frames: For the encoded request frames.
+        :param request_ids: For the request ids, in order.
+        :return: The result flags by request id.
+        """
+        try:
+            conn.sendall(b''.join(frames))
+            responses = {}
+            for _ in request_ids:
+                request_id, status, entries_count = RESPONSE_HEADER.unpack(
+                    self.receive_exactly(conn, RESPONSE_HEADER.size))
+                results = self.receive_exactly(conn, entries_count)
+                if status != IndexStatus.OK:
+                    raise DedupIndexError(f"[!] Dedup index service failed request #{request_id}.")
+                responses[request_id] = [bool(result) for result in results]
+            return responses
+        except (OSError, struct.error, DedupIndexError):
+            conn.close()
+            raise
+
+    def pipeline(self, requests: list) -> list:
+        """
+        Sends several requests on one connection before reading any response.
+        :param requests: For the (operation, entries) requests, entries being (digest hex string, name) tuples.
+        :return: The result flags list of every request, in order.
+        """
+        frames = []
+        request_ids = []
+        for operation, entries in requests:
+            for start in range(0, max(len(entries), 1), MAX_ENTRIES):
+                with self.ids_lock:
+                    request_id = next(self.request_ids) & 0xFFFFFFFF
+                request_ids.append(request_id)
+                frames.append(encode_request(request_id, operation, entries[start:start + MAX_ENTRIES]))
+        conn, pooled = self.acquire()
+        try:
+            responses = self.exchange(conn, frames, request_ids)
+        except ConnectionError:
+            if not pooled:
+                raise
+            # A restarted service leaves every pooled connection closed, retried once on a fresh connection
+            self.close()
+            conn = self.open_connection()
+            responses = self.exchange(conn, frames, request_ids)
+        self.release_connection(conn)
+        # Requests split for the entries limit are merged back
+        results = []
+        request_index = 0
+        for _, entries in requests:
+            merged = []
+            for _ in range(max((len(entries) + MAX_ENTRIES - 1) // MAX_ENTRIES, 1)):
+                merged.extend(responses.get(request_ids[request_index], []))
+                request_index += 1
+            results.append(merged)
+        return results
+
+    def lookup(self, digests: list) -> list:
+        """
+        Checks whether the given digests are claimed.
+        :param digests: For the md5 digests hex strings.
+        :return: True for every claimed digest, False otherwise.
+        """
+        return self.pipeline([(IndexOperations.LOOKUP, [(digest, '') for digest in digests])])[0]
+
+    def claim(self, entries: list) -> list:
+        """
+        Atomically claims the given digests for the given names.
+        :param entries: For the (md5 digest hex string, name) entries.
+        :return: True for every digest claimed by this request, False for digests already claimed.
+        """
+        return self.pipeline([(IndexOperations.CLAIM, entries)])[0]
+
+    def release(self, entries: list) -> list:
+        """
+        Releases the given digests, a digest is only released for the name that claimed it.
+        :param entries: For the (md5 digest hex string, name) entries.
+        :return: True for every digest that was claimed by the name and got released, False otherwise.
+        """
+        return self.pipeline([(IndexOperations.RELEASE, entries)])[0]
+
+
+"""
+Custom exception for dedup index service errors.
+"""
+
+
+class DedupIndexError(Exception):
+    pass
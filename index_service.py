@@ -0,0 +1,218 @@
+"""
+Dedup Index Service for sharing one hash index between consumers running on several nodes.
+The index is kept in memory, every change is appended to a log file, and the log is compacted
+into a snapshot file every configured number of changes. See index_client.py for the protocol.
+"""
+import asyncio
+import os
+import struct
+from logger import Logger
+from config_parser import get_configuration
+from index_client import REQUEST_HEADER, RESPONSE_HEADER, DIGEST_SIZE, IndexOperations, IndexStatus, decode_entries
+
+
+LOG_RECORD_HEADER = struct.Struct(f"!B{DIGEST_SIZE}sH")
+
+
+class DedupIndexService:
+
+    def __init__(self, log_file: str, snapshot_file: str, snapshot_every: int, fsync: bool = False):
+        """
+        Class Constructor.
+        :param log_file: For the append log file.
+        :param snapshot_file: For the snapshot file.
+        :param snapshot_every: For the number of logged changes after which a snapshot is written.
+        :param fsync: For syncing the log file to disk after every request.
+        """
+        self.log_file = log_file
+        self.snapshot_file = snapshot_file
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.index = {}
+        self.log = None
+        self.logged_changes = 0
+        self.class_logger = Logger('DedupIndexService')
+
+    @staticmethod
+    def read_records(file: str):
+        """
+        Reads the records of a log or snapshot file, a truncated last record is ignored.
+        :param file: For the file to read.
+        :return: A generator of (operation, raw digest, name) records.
+        """
+        if not os.path.exists(file):
+            return None
+        with open(file, 'rb') as f:
+            data = f.read()
+        offset = 0
+        while offset + LOG_RECORD_HEADER.size <= len(data):
+            operation, digest, name_length = LOG_RECORD_HEADER.unpack_from(data, offset)
+            offset += LOG_RECORD_HEADER.size
+            if offset + name_length > len(data):
+                break
+            yield operation, digest, data[offset:offset + name_length].decode()
+            offset += name_length
+
+    @staticmethod
+    def encode_record(operation: int, digest: bytes, name: str) -> bytes:
+        """
+        Encodes a log or snapshot record.
+        :param operation: For the change operation.
+        :param digest: For the raw digest.
+        :param name: For the claiming name.
+        :return: The encoded record.
+        """
+        encoded_name = name.encode()
+        return LOG_RECORD_HEADER.pack(operation, digest, len(encoded_name)) + encoded_name
+
+    def load(self) -> None:
+        """
+        Loads the snapshot and replays the log on top of it, then opens the log for appending.
+        """
+        for _, digest, name in self.read_records(self.snapshot_file):
+            self.index[digest] = name
+        for operation, digest, name in self.read_records(self.log_file):
+            self.apply(operation, digest, name)
+            self.logged_changes += 1
+        self.log = open(self.log_file, 'ab')
+        print(f"[+] Dedup index loaded with {len(self.index)} digests.")
+        self.class_logger.logger.info("Dedup index loaded with %s digests, %s logged changes.", len(self.index),
+                                      self.logged_changes)
+
+    def apply(self, operation: int, digest: bytes, name: str) -> bool:
+        """
+        Applies a single operation to the in memory index.
+        :param operation: For the operation, see IndexOperations.
+        :param digest: For the raw digest.
+        :param name: For the claiming name, or the releasing name which must match it.
+        :return: The operation result, see DedupIndexClient.
+        """
+        if operation == IndexOperations.LOOKUP:
+            return digest in self.index
+        if operation == IndexOperations.CLAIM:
+            if digest in self.index:
+                return False
+            self.index[digest] = name
+            return True
+        if operation == IndexOperations.RELEASE:
+            # Only the claiming name releases a digest, a node must never drop another node claim
+            if digest not in self.index or self.index[digest] != name:
+                return False
+            del self.index[digest]
+            return True
+        raise ValueError(f"Unknown operation {operation}")
+
+    def handle_request(self, operation: int, entries: list) -> bytes:
+        """
+        Handles a batch of entries, logging the changes before answering.
+        :param operation: For the operation, see IndexOperations.
+        :param entries: For the (raw digest, name) entries.
+        :return: One result byte per entry.
+        """
+        results = bytearray()
+        changes = []
+        for digest, name in entries:
+            result = self.apply(operation, digest, name)
+            results.append(result)
+            if result and operation != IndexOperations.LOOKUP:
+                changes.append(self.encode_record(operation, digest, name))
+        if changes:
+            self.log.write(b''.join(changes))
+            self.log.flush()
+            if self.fsync:
+                os.fsync(self.log.fileno())
+            self.logged_changes += len(changes)
+            if self.logged_changes >= self.snapshot_every:
+                self.write_snapshot()
+        return bytes(results)
+
+    def write_snapshot(self) -> None:
+        """
+        Writes the whole index to the snapshot file and truncates the log.
+        """
+        temp_file = f"{self.snapshot_file}.tmp"
+        with open(temp_file, 'wb') as f:
+            for digest, name in self.index.items():
+                f.write(self.encode_record(IndexOperations.CLAIM, digest, name))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.snapshot_file)
+        self.log.close()
+        self.log = open(self.log_file, 'wb')
+        self.class_logger.logger.info("Wrote dedup index snapshot of %s digests after %s changes.", len(self.index),
+                                      self.logged_changes)
+        self.logged_changes = 0
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Serves a client connection, requests are answered in order so clients may pipeline them.
+        :param reader: For the connection reader.
+        :param writer: For the connection writer.
+        """
+        try:
+            while True:
+                header = await reader.readexactly(REQUEST_HEADER.size)
+                request_id, operation, entries_count, payload_length = REQUEST_HEADER.unpack(header)
+                payload = await reader.readexactly(payload_length)
+                try:
+                    results = self.handle_request(operation, decode_entries(payload, entries_count))
+                    status = IndexStatus.OK
+                except (ValueError, struct.error, UnicodeDecodeError, OSError) as err:
+                    self.class_logger.logger.error("Unable to handle request #%s, Error: %s.", request_id, err)
+                    results = b''
+                    status = IndexStatus.ERROR
+                writer.write(RESPONSE_HEADER.pack(request_id, status, len(results)) + results)
+                # Only waits when the client stops reading, pipelined responses are written back to back
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int, unix_socket: str = None) -> None:
+        """
+        Serves clients forever.
+        :param host: For the TCP host to listen on.
+        :param port: For the TCP port to listen on.
+        :param unix_socket: For a unix socket path to listen on instead of TCP.
+        """
+        if unix_socket:
+            server = await asyncio.start_unix_server(self.handle_client, path=unix_socket)
+            address = unix_socket
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port)
+            address = f"{host}:{port}"
+        print(f"[+] Dedup index service is listening on '{address}'...")
+        self.class_logger.logger.info("Dedup index service is listening on '%s'.", address)
+        async with server:
+            await server.serve_forever()
+
+    def close(self) -> None:
+        """
+        Closes the log file.
+        """
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+
+def index_service_main():
+
+    service = DedupIndexService(str(get_configuration("log_file", "dedup_index")),
+                                str(get_configuration("snapshot_file", "dedup_index")),
+                                int(get_configuration("snapshot_every", "dedup_index")),
+                                str(get_configuration("fsync", "dedup_index")) == "true")
+    service.load()
+    unix_socket = str(get_configuration("unix_socket", "dedup_index"))
+    try:
+        asyncio.run(service.serve(str(get_configuration("host", "dedup_index")),
+                                  int(get_configuration("port", "dedup_index")),
+                                  unix_socket if unix_socket else None))
+    except KeyboardInterrupt:
+        print("[+] Stopped dedup index service.")
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    index_service_main()
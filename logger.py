@@ -1,32 +1,85 @@
 """
 Custom logger class based on python logging library.
+Logging is configured once per process, records are handed to a background writer thread
+through a queue so the calling threads never block on log I/O.
 """
+import atexit
 import logging
+import logging.handlers
+import queue
+from threading import Lock
 from config_parser import get_configuration
 
 
+_setup_lock = Lock()
+_listener = None
+_log_level = None
+
+
+def setup_logging() -> int:
+    """
+    Configures the root logger once, following calls return the already configured level.
+    Initializes the Following:
+    1. log file name, path, mode and optional size based rotation.
+    2. log level.
+    3. log date and time format.
+    4. queue handler and the background listener writing the records.
+    :return: The configured log level.
+    """
+    global _listener, _log_level
+    with _setup_lock:
+        if _log_level is not None:
+            return _log_level
+        log_file = str(get_configuration("main_file_name", "logger"))
+        log_file_mode = str(get_configuration("file_mode", "logger"))
+        log_format = str(get_configuration("log_format", "logger"))
+        date_format = str(get_configuration("date_format", "logger"))
+        max_bytes = int(get_configuration("max_bytes", "logger"))
+        backup_count = int(get_configuration("backup_count", "logger"))
+        _log_level = Logger.set_log_level()
+
+        # Rotation is only enabled when a max size is configured
+        if max_bytes > 0:
+            file_handler = logging.handlers.RotatingFileHandler(log_file, mode=log_file_mode, maxBytes=max_bytes,
+                                                                backupCount=backup_count)
+        else:
+            file_handler = logging.FileHandler(log_file, mode=log_file_mode)
+        file_handler.setFormatter(logging.Formatter(log_format, date_format))
+
+        log_queue = queue.SimpleQueue()
+        root_logger = logging.getLogger()
+        root_logger.setLevel(_log_level)
+        root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+        return _log_level
+
+
+def stop_logging() -> None:
+    """
+    Stops the background listener after writing all the pending records.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
 class Logger:
 
     def __init__(self, logger_name: str):
         """
         Class Constructor.
-        Initializes the Following:
-        1. log file name, path and mode.
-        2. log level.
-        3. log date and time format.
         :param logger_name: For the logger name to be shown in the log file.
         """
         # Create logger
         self.logger = logging.getLogger(logger_name)
-        log_file = str(get_configuration("main_file_name", "logger"))
-        log_file_mode = str(get_configuration("file_mode", "logger"))
-        # Set level and format
-        log_level = self.set_log_level()
-        self.logger.setLevel(log_level)
-        log_format = str(get_configuration("log_format", "logger"))
-        date_format = str(get_configuration("date_format", "logger"))
-        logging.basicConfig(filename=log_file, filemode=log_file_mode, level=log_level,
-                            format=log_format, datefmt=date_format)
+        log_level = setup_logging()
+        # Setting the level clears the logging module cache, skip it for already configured loggers
+        if self.logger.level != log_level:
+            self.logger.setLevel(log_level)
 
     @staticmethod
     def set_log_level() -> int:
@@ -38,5 +91,3 @@ class Logger:
             return logging.INFO
         elif log_level == "true".lower():
             return logging.DEBUG
-
-
@@ -1,12 +1,120 @@
 """
 Producer Class for publish file changes events to RabbitMQ queue.
 """
+import logging
 import pika
 import pika.exceptions
-from time import sleep
+import queue
+from time import sleep, monotonic
+from threading import Thread, Event, Lock
+from logger import Logger
 from config_parser import get_configuration
 
 
+class BackpressureController:
+    """
+    Keeps the RabbitMQ queue depth within a target band:
+    1. above the band, the coalescing window is widened and publishing is throttled to the consumers ack rate.
+    2. inside the band, the current window and throttle are kept.
+    3. below the band, the window is narrowed and the throttle is lifted.
+    Publishing stops entirely while the broker reports the connection as blocked.
+    """
+    def __init__(self, target_low: int, target_high: int, max_window: float, min_rate: float):
+        """
+        Class Constructor.
+        :param target_low: For the queue depth under which the controller relaxes.
+        :param target_high: For the queue depth above which the controller tightens.
+        :param max_window: For the widest coalescing window in seconds.
+        :param min_rate: For the lowest publish rate in messages per second when throttling.
+        """
+        self.target_low = target_low
+        self.target_high = target_high
+        self.max_window = max_window
+        self.min_rate = min_rate
+        self.lock = Lock()
+        self.depth = None
+        self.ack_rate = 0.0
+        self.publish_rate = 0.0
+        self.window = 0.0
+        self.rate_limit = None
+        self.blocked = False
+        self.published = 0
+        self.coalesced = 0
+        self.last_check = None
+        self.tokens = 0.0
+        self.last_token_time = monotonic()
+
+    def update(self, depth: int, now: float) -> None:
+        """
+        Updates the control state with a new queue depth sample.
+        :param depth: For the current queue depth.
+        :param now: For the sample time.
+        """
+        with self.lock:
+            if self.depth is not None:
+                elapsed = max(now - self.last_check, 1e-6)
+                # Whatever was published and did not stay in the queue was consumed
+                self.ack_rate = max(self.published - (depth - self.depth), 0) / elapsed
+                self.publish_rate = self.published / elapsed
+            self.depth = depth
+            self.last_check = now
+            self.published = 0
+            if depth > self.target_high:
+                self.window = min(max(self.window * 2, 0.05), self.max_window)
+                self.rate_limit = max(self.ack_rate * 0.9, self.min_rate)
+            elif depth < self.target_low:
+                self.window = self.window / 2 if self.window >= 0.1 else 0.0
+                self.rate_limit = None
+            elif self.rate_limit is not None:
+                self.rate_limit = max(self.ack_rate, self.min_rate)
+
+    def acquire(self, now: float) -> bool:
+        """
+        Takes a publish token from the rate limiting bucket.
+        :param now: For the current time.
+        :return: True if a message may be published now, False otherwise.
+        """
+        with self.lock:
+            if self.blocked:
+                return False
+            if self.rate_limit is None:
+                return True
+            self.tokens = min(self.tokens + (now - self.last_token_time) * self.rate_limit, self.rate_limit)
+            self.last_token_time = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def on_published(self, events_count: int) -> None:
+        """
+        Counts a published message.
+        :param events_count: For the number of events coalesced into the message.
+        """
+        with self.lock:
+            self.published += 1
+            self.coalesced += events_count - 1
+
+    def set_blocked(self, blocked: bool) -> None:
+        """
+        Sets the broker blocked state.
+        :param blocked: For whether the broker blocked the connection.
+        """
+        with self.lock:
+            self.blocked = blocked
+            self.last_token_time = monotonic()
+
+    def get_state(self) -> dict:
+        """
+        Gets the control loop state for tuning.
+        :return: A copy of the state.
+        """
+        with self.lock:
+            return {"depth": self.depth, "ack_rate": self.ack_rate, "publish_rate": self.publish_rate,
+                    "window": self.window, "rate_limit": self.rate_limit, "blocked": self.blocked,
+                    "coalesced": self.coalesced}
+
+
 class Producer:
 
     def __init__(self, host: str):
@@ -19,7 +127,23 @@ class Producer:
         self.connection = None
         self.channel = None
         self.RECONNECTING_BUFFER = get_configuration("reconnecting_buffer")
+        self.controller = None
+        self.publisher_thread = None
+        if str(get_configuration("enabled", "backpressure")) == "true":
+            self.controller = BackpressureController(int(get_configuration("target_low", "backpressure")),
+                                                     int(get_configuration("target_high", "backpressure")),
+                                                     float(get_configuration("max_window", "backpressure")),
+                                                     float(get_configuration("min_rate", "backpressure")))
+            self.check_interval = float(get_configuration("check_interval", "backpressure"))
+            self.max_batch = int(get_configuration("max_batch", "backpressure"))
+            self.outbox = queue.Queue(int(get_configuration("outbox_size", "backpressure")))
+            self.stop_event = Event()
+            self.class_logger = Logger('Producer')
         self.connect()
+        if self.controller is not None:
+            # The publisher thread owns the connection from now on
+            self.publisher_thread = Thread(target=self.run_publisher, name='Publisher', daemon=True)
+            self.publisher_thread.start()
 
     def connect(self) -> None:
         """
@@ -28,6 +152,9 @@ class Producer:
         self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.host))
         self.channel = self.connection.channel()
         self.channel.queue_declare(queue=self.queue)
+        if self.controller is not None:
+            self.connection.add_on_connection_blocked_callback(self.on_connection_blocked)
+            self.connection.add_on_connection_unblocked_callback(self.on_connection_unblocked)
         print(f"[+] Producer connected successfully to RabbitMQ queue '{self.queue}'.")
 
     def reconnect(self) -> None:
@@ -49,11 +176,193 @@ class Producer:
         """
         Closes the RabbitMQ connection.
         """
-        self.connection.close()
+        if self.publisher_thread is not None:
+            self.stop_event.set()
+            self.publisher_thread.join()
+            self.publisher_thread = None
+        if self.connection is not None and self.connection.is_open:
+            self.connection.close()
 
     def publish(self, msg: str) -> None:
         """
         Publish a given msg to RabbitMQ queue.
+        With backpressure enabled the msg is handed to the publisher thread,
+        blocking the caller while the outbox is full.
         :param msg: For the msg to publish.
         """
-        self.channel.basic_publish(exchange='', routing_key=self.queue, body=msg)
+        if self.controller is not None:
+            while True:
+                # A stopped publisher thread would never empty the outbox
+                if self.publisher_thread is None or not self.publisher_thread.is_alive():
+                    raise PublisherError(f"[!] Producer publisher thread is not running, unable to publish '{msg}'.")
+                try:
+                    self.outbox.put(msg, timeout=1)
+                    return None
+                except queue.Full:
+                    continue
+        else:
+            self.channel.basic_publish(exchange='', routing_key=self.queue, body=msg)
+
+    def on_connection_blocked(self, connection, method) -> None:
+        """
+        RabbitMQ callback for the 'connection.blocked' notification, sent when a broker resource alarm trips.
+        """
+        self.controller.set_blocked(True)
+        print(f"[!] RabbitMQ blocked the producer connection, Reason: {method.method.reason}.")
+        self.class_logger.logger.error("RabbitMQ blocked the producer connection, Reason: %s.",
+                                       method.method.reason)
+
+    def on_connection_unblocked(self, connection, method) -> None:
+        """
+        RabbitMQ callback for the 'connection.unblocked' notification.
+        """
+        self.controller.set_blocked(False)
+        print("[+] RabbitMQ unblocked the producer connection.")
+        self.class_logger.logger.info("RabbitMQ unblocked the producer connection.")
+
+    @staticmethod
+    def coalesce(pending: dict, msg: str) -> bool:
+        """
+        Adds a msg to the pending events of its file path, in their original order.
+        A 'modified' event is absorbed by a pending 'created' or 'modified' event of the same file,
+        every other sequence is kept, e.g. 'deleted' then 'created' must still delete the old file row.
+        The pending events are only ordered per path, so a 'moved' event, relating two paths, is only added
+        to empty pending events, every pending event stays before it and every following event after it.
+        :param pending: For the pending events lists by file path.
+        :param msg: For the msg to add.
+        :return: True if added, False if the pending events must be published first.
+        """
+        event_type, _, path = msg.partition(' ')
+        if event_type == 'moved':
+            if pending:
+                return False
+            path = path.split(' ')[0]
+        events = pending.get(path)
+        if events is None:
+            pending[path] = [msg]
+        elif event_type != 'modified' or events[-1].partition(' ')[0] not in ('created', 'modified'):
+            events.append(msg)
+        return True
+
+    def send_pending(self, pending: dict, events_count: int) -> None:
+        """
+        Publishes the pending events as one message, one event per line.
+        The pending events are only cleared once published, so they are sent again after a failure.
+        :param pending: For the pending events lists by file path.
+        :param events_count: For the number of events received for the pending files.
+        """
+        body = '\n'.join(msg for events in pending.values() for msg in events)
+        self.channel.basic_publish(exchange='', routing_key=self.queue, body=body)
+        self.controller.on_published(events_count)
+        pending.clear()
+
+    def reconnect_with_backoff(self) -> bool:
+        """
+        Reconnects from the publisher thread until connected or stopped, doubling the wait between attempts
+        up to the reconnecting buffer.
+        :return: True once reconnected, False if the producer was stopped first.
+        """
+        delay = 0.5
+        while not self.stop_event.wait(delay):
+            try:
+                if self.connection is not None and self.connection.is_open:
+                    self.connection.close()
+            except pika.exceptions.AMQPError:
+                pass
+            try:
+                self.connect()
+                return True
+            except pika.exceptions.AMQPError as err:
+                self.class_logger.logger.error("Publisher reconnection failed, retrying in %s seconds, Error: %s.",
+                                               delay, err)
+            delay = min(delay * 2, float(self.RECONNECTING_BUFFER))
+        return False
+
+    def check_queue_depth(self) -> None:
+        """
+        Samples the queue depth with a passive declare and updates the controller.
+        """
+        try:
+            frame = self.channel.queue_declare(queue=self.queue, passive=True)
+        except pika.exceptions.AMQPError as err:
+            self.class_logger.logger.error("Unable to read queue depth, Error: %s.", err)
+            return None
+        previous_state = self.controller.get_state()
+        self.controller.update(frame.method.message_count, monotonic())
+        state = self.controller.get_state()
+        # Logged on every check for tuning only, otherwise when the controller changes its decision
+        if (state["window"], state["rate_limit"] is None, state["blocked"]) != \
+                (previous_state["window"], previous_state["rate_limit"] is None, previous_state["blocked"]):
+            self.class_logger.logger.info("Backpressure state: %s", state)
+        elif self.class_logger.logger.isEnabledFor(logging.DEBUG):
+            self.class_logger.logger.debug("Backpressure state: %s", state)
+
+    def run_publisher(self) -> None:
+        """
+        Publisher thread loop, coalesces the outbox events during the controller window
+        and publishes them within the controller rate limit.
+        """
+        pending = {}
+        # An event waiting for the pending events to be published, see coalesce
+        held = None
+        events_count = 0
+        window_start = 0.0
+        last_check = 0.0
+        # Pending events are dropped on stop only while the broker blocks the connection
+        while (not self.stop_event.is_set() or (pending or held or not self.outbox.empty())
+               and not self.controller.blocked):
+            try:
+                if len(pending) >= self.max_batch or held is not None:
+                    # Throttled or blocked, leave the events in the bounded outbox so the watcher slows down
+                    self.stop_event.wait(0.01)
+                else:
+                    try:
+                        msg = self.outbox.get(timeout=0.05)
+                        if not pending:
+                            window_start = monotonic()
+                        # Drain what is already waiting without blocking
+                        while True:
+                            if not self.coalesce(pending, msg):
+                                held = msg
+                                break
+                            events_count += 1
+                            if len(pending) >= self.max_batch:
+                                break
+                            msg = self.outbox.get_nowait()
+                    except queue.Empty:
+                        pass
+                now = monotonic()
+                if now - last_check >= self.check_interval:
+                    self.check_queue_depth()
+                    last_check = now
+                # Serves heartbeats and the blocked notifications
+                self.connection.process_data_events(time_limit=0)
+                window_over = (now - window_start >= self.controller.window or len(pending) >= self.max_batch
+                               or held is not None)
+                if pending and (window_over or self.stop_event.is_set()) and self.controller.acquire(now):
+                    self.send_pending(pending, events_count)
+                    events_count = 0
+                    if held is not None:
+                        self.coalesce(pending, held)
+                        held = None
+                        events_count = 1
+                        window_start = now
+            except Exception as err:
+                # The pending events are kept and sent once reconnected
+                print(f"[!] Unable to send events to RabbitMQ, Error: {err}, Trying to reconnect...")
+                self.class_logger.logger.error("Publisher failed with %s pending files, Error: %s.", len(pending),
+                                               err)
+                if not self.reconnect_with_backoff():
+                    self.class_logger.logger.error("Producer stopped while disconnected, dropped %s pending files "
+                                                   "and %s outbox events.", len(pending) + (held is not None),
+                                                   self.outbox.qsize())
+                    break
+
+
+"""
+Custom exception for publisher errors.
+"""
+
+
+class PublisherError(Exception):
+    pass
@@ -0,0 +1,207 @@
+"""
+Profiler Class for profiling the running FileHandler, toggled from the config file or at runtime with a signal.
+Periodically dumps to the output directory:
+1. sampled cProfile statistics of the consumer message handling.
+2. tracemalloc top allocation differences between intervals.
+3. wall and CPU time of the tracked threads.
+"""
+import cProfile
+import os
+import pstats
+import random
+import signal
+import time
+import tracemalloc
+from threading import Thread, Lock, Event
+from logger import Logger
+from config_parser import get_configuration
+
+
+class Profiler:
+
+    def __init__(self):
+        """
+        Class Constructor.
+        """
+        self.enabled = str(get_configuration("enabled", "profiler")) == "true"
+        self.output_dir = str(get_configuration("output_dir", "profiler"))
+        self.sample_rate = float(get_configuration("sample_rate", "profiler"))
+        self.max_samples = int(get_configuration("max_samples_per_interval", "profiler"))
+        self.dump_interval = float(get_configuration("dump_interval", "profiler"))
+        self.trace_memory = str(get_configuration("tracemalloc", "profiler")) == "true"
+        self.toggle_signal = str(get_configuration("toggle_signal", "profiler"))
+        self.lock = Lock()
+        self.stop_event = Event()
+        self.dump_thread = None
+        self.stats = None
+        self.samples = 0
+        self.messages = 0
+        self.memory_snapshot = None
+        self.threads = {}
+        self.class_logger = Logger('Profiler')
+
+    def start(self) -> None:
+        """
+        Installs the runtime toggle signal and starts the periodic dump thread.
+        """
+        self.install_signal_handler()
+        if self.enabled:
+            self.enable()
+        self.dump_thread = Thread(target=self.dump_loop, name='Profiler', daemon=True)
+        self.dump_thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the dump thread and writes the last interval.
+        """
+        self.stop_event.set()
+        if self.enabled:
+            self.dump()
+            self.disable()
+
+    def install_signal_handler(self) -> None:
+        """
+        Toggles the profiler on the configured signal, only possible from the main thread.
+        """
+        signal_number = getattr(signal, self.toggle_signal, None)
+        if signal_number is None:
+            return None
+        try:
+            signal.signal(signal_number, lambda signum, frame: self.toggle())
+        except ValueError as err:
+            self.class_logger.logger.error("Unable to install profiler signal handler, Error: %s.", err)
+
+    def toggle(self) -> None:
+        """
+        Switches profiling on or off at runtime.
+        """
+        if self.enabled:
+            self.dump()
+            self.disable()
+        else:
+            self.enable()
+
+    def enable(self) -> None:
+        """
+        Enables profiling.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.memory_snapshot = tracemalloc.take_snapshot()
+        self.enabled = True
+        print(f"[+] Profiler enabled, writing dumps to '{self.output_dir}'.")
+        self.class_logger.logger.info("Profiler enabled, writing dumps to '%s'.", self.output_dir)
+
+    def disable(self) -> None:
+        """
+        Disables profiling and releases the tracemalloc traces.
+        """
+        self.enabled = False
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.memory_snapshot = None
+        print("[+] Profiler disabled.")
+        self.class_logger.logger.info("Profiler disabled.")
+
+    def track_thread(self, label: str, thread: Thread) -> None:
+        """
+        Adds a thread to the per thread wall and CPU time report.
+        :param label: For the thread role to be shown in the report.
+        :param thread: For the thread to track.
+        """
+        with self.lock:
+            self.threads[label] = (thread, time.monotonic())
+
+    def profile_call(self, func, *args):
+        """
+        Calls a given function, profiling it with cProfile for a bounded sample of the calls.
+        :param func: For the function to call.
+        :param args: For the function arguments.
+        :return: The function return value.
+        """
+        self.messages += 1
+        if self.samples >= self.max_samples or random.random() >= self.sample_rate:
+            return func(*args)
+        self.samples += 1
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args)
+        finally:
+            with self.lock:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile)
+                else:
+                    self.stats.add(profile)
+
+    def dump_loop(self) -> None:
+        """
+        Dumps the collected data every dump interval while profiling is enabled.
+        """
+        while not self.stop_event.wait(self.dump_interval):
+            if self.enabled:
+                self.dump()
+
+    def dump(self) -> None:
+        """
+        Writes the current interval data to the output directory and resets the sample budget.
+        """
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        with self.lock:
+            stats, self.stats = self.stats, None
+            samples, self.samples = self.samples, 0
+            messages, self.messages = self.messages, 0
+            threads = dict(self.threads)
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            if stats is not None:
+                stats.dump_stats(os.path.join(self.output_dir, f"messages_{timestamp}.prof"))
+            self.dump_memory(timestamp)
+            self.dump_threads(timestamp, threads)
+            self.class_logger.logger.info("Profiler dumped %s sampled messages out of %s.", samples, messages)
+        except OSError as err:
+            self.class_logger.logger.error("Unable to write profiler dump, Error: %s.", err)
+
+    def dump_memory(self, timestamp: str) -> None:
+        """
+        Writes the top allocation differences since the previous snapshot.
+        :param timestamp: For the dump file name suffix.
+        """
+        if not tracemalloc.is_tracing():
+            return None
+        snapshot = tracemalloc.take_snapshot()
+        if self.memory_snapshot is not None:
+            with open(os.path.join(self.output_dir, f"memory_{timestamp}.txt"), 'w') as out_file:
+                for stat in snapshot.compare_to(self.memory_snapshot, 'lineno')[:25]:
+                    out_file.write(f"{stat}\n")
+        self.memory_snapshot = snapshot
+
+    def dump_threads(self, timestamp: str, threads: dict) -> None:
+        """
+        Writes the wall and CPU time of the tracked threads.
+        :param timestamp: For the dump file name suffix.
+        :param threads: For the tracked threads and their tracking start time.
+        """
+        if not threads:
+            return None
+        with open(os.path.join(self.output_dir, f"threads_{timestamp}.txt"), 'w') as out_file:
+            for label, (thread, start_time) in threads.items():
+                wall_time = time.monotonic() - start_time
+                cpu_time = get_thread_cpu_time(thread)
+                cpu = 'n/a' if cpu_time is None else f"{cpu_time:.3f}"
+                out_file.write(f"{label} ({thread.name}): wall {wall_time:.3f}s, cpu {cpu}s, "
+                               f"alive {thread.is_alive()}\n")
+
+
+def get_thread_cpu_time(thread: Thread):
+    """
+    Gets the CPU time of a given thread, supported on platforms exposing per thread CPU clocks.
+    :param thread: For the thread to check.
+    :return: The thread CPU time in seconds, None if unavailable.
+    """
+    if thread.ident is None or not thread.is_alive() or not hasattr(time, 'pthread_getcpuclockid'):
+        return None
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+    except (OSError, OverflowError):
+        return None
@@ -0,0 +1,155 @@
+"""
+Event Recorder Class for capturing the raw watchdog event stream into a compact file,
+so production event bursts can be replayed offline, see replayer.py.
+"""
+import atexit
+import gzip
+import os
+import signal
+import zlib
+from threading import Thread, Event, Lock
+from time import monotonic
+from logger import Logger
+
+
+class EventRecorder:
+    """
+    Records every raw watchdog event as one gzip compressed, tab separated line:
+    '<seconds since start>\t<event type>\t<is directory>\t<file size>\t<source path>\t<destination path>'.
+    The gzip stream is sync flushed every given number of events or seconds, so a killed process
+    loses at most the events since the last flush.
+    """
+    def __init__(self, file_name: str, flush_every: int = 1000, flush_interval: float = 1):
+        """
+        Class Constructor.
+        :param file_name: For the record file to write.
+        :param flush_every: For the number of events after which the record file is flushed.
+        :param flush_interval: For the seconds after which pending events are flushed.
+        """
+        self.file_name = file_name
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.record_file = gzip.open(file_name, 'wt', encoding='utf-8')
+        self.start_time = monotonic()
+        self.events_count = 0
+        self.unflushed_count = 0
+        self.lock = Lock()
+        self.stop_event = Event()
+        self.previous_sigterm_handler = None
+        self.class_logger = Logger('EventRecorder')
+        self.class_logger.logger.info(f"Recording file events to '{self.file_name}'.")
+        self.flusher = Thread(target=self.run_flusher, name='EventRecorder flusher', daemon=True)
+        self.flusher.start()
+        atexit.register(self.close)
+
+    def install_signal_handler(self) -> None:
+        """
+        Closes the record file on SIGTERM before terminating, only possible from the main thread.
+        """
+        try:
+            self.previous_sigterm_handler = signal.signal(signal.SIGTERM, self.on_sigterm)
+        except ValueError as err:
+            self.class_logger.logger.error("Unable to install recorder signal handler, Error: %s.", err)
+
+    def on_sigterm(self, signum, frame) -> None:
+        """
+        SIGTERM handler, closes the record file and hands the signal over to the previous handler.
+        """
+        self.close()
+        signal.signal(signal.SIGTERM, self.previous_sigterm_handler or signal.SIG_DFL)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    def run_flusher(self) -> None:
+        """
+        Flusher thread loop, flushes pending events every flush interval.
+        """
+        while not self.stop_event.wait(self.flush_interval):
+            with self.lock:
+                if self.record_file is not None and self.unflushed_count:
+                    self.flush()
+
+    def flush(self) -> None:
+        """
+        Sync flushes the gzip stream so everything written so far can be read back, called with the lock held.
+        """
+        self.record_file.flush()
+        self.unflushed_count = 0
+
+    def record(self, event) -> None:
+        """
+        Writes a given watchdog event to the record file.
+        :param event: For the watchdog event to record.
+        """
+        offset = monotonic() - self.start_time
+        dest_path = getattr(event, 'dest_path', '') or ''
+        size = self.get_file_size(dest_path or event.src_path)
+        line = f"{offset:.6f}\t{event.event_type}\t{int(event.is_directory)}\t{size}\t{event.src_path}\t{dest_path}\n"
+        with self.lock:
+            if self.record_file is None:
+                return None
+            self.record_file.write(line)
+            self.events_count += 1
+            self.unflushed_count += 1
+            if self.unflushed_count >= self.flush_every:
+                self.flush()
+
+    def close(self) -> None:
+        """
+        Flushes and closes the record file.
+        """
+        self.stop_event.set()
+        with self.lock:
+            if self.record_file is not None:
+                self.record_file.close()
+                self.record_file = None
+                self.class_logger.logger.info(f"Recorded {self.events_count} events to '{self.file_name}'.")
+
+    @staticmethod
+    def get_file_size(file: str) -> int:
+        """
+        Auxiliary method for getting the current file size, used to materialize the file on replay.
+        :param file: For the file to check.
+        :return: The file size in bytes, -1 if the file no longer exists.
+        """
+        try:
+            return os.stat(file).st_size
+        except OSError:
+            return -1
+
+
+class RecordedEvent:
+    """
+    Auxiliary class for a single event read back from a record file.
+    """
+    __slots__ = ('offset', 'event_type', 'is_directory', 'size', 'src_path', 'dest_path')
+
+    def __init__(self, offset: float, event_type: str, is_directory: bool, size: int, src_path: str,
+                 dest_path: str):
+        """
+        Class Constructor.
+        """
+        self.offset = offset
+        self.event_type = event_type
+        self.is_directory = is_directory
+        self.size = size
+        self.src_path = src_path
+        self.dest_path = dest_path
+
+
+def read_record_file(file_name: str):
+    """
+    Lazily reads a given record file, a file cut short by a killed recorder is read up to its last complete event.
+    :param file_name: For the record file to read.
+    :return: A generator of the recorded events in their original order.
+    """
+    with gzip.open(file_name, 'rt', encoding='utf-8') as record_file:
+        try:
+            for line in record_file:
+                if not line.endswith('\n'):
+                    # Partly written last event
+                    break
+                offset, event_type, is_directory, size, src_path, dest_path = line.rstrip('\n').split('\t')
+                yield RecordedEvent(float(offset), event_type, is_directory == '1', int(size), src_path, dest_path)
+        except (EOFError, zlib.error, gzip.BadGzipFile):
+            # The gzip stream ends without its end of stream marker
+            return None
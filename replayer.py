@@ -0,0 +1,193 @@
+"""
+Event Replayer Class for feeding a recorded watchdog event stream back into the project,
+to reproduce production throughput problems offline.
+"""
+import os
+import random
+from time import sleep, monotonic
+from logger import Logger
+from recorder import read_record_file
+from event_filter import EventFilter
+from config_parser import get_configuration
+
+
+class ReplayTargets:
+    PRODUCER = 'producer'
+    CONSUMER = 'consumer'
+
+
+class EventReplayer:
+
+    def __init__(self, host: str, record_file: str, target: str = ReplayTargets.PRODUCER, speed: float = 1,
+                 scratch_dir: str = None):
+        """
+        Class Constructor.
+        :param host: For the RabbitMQ host, used by the producer target.
+        :param record_file: For the record file to replay.
+        :param target: For where to feed the events, 'producer' or 'consumer'.
+        :param speed: For the replay speed multiplier, 0 to replay as fast as possible.
+        :param scratch_dir: For a directory to materialize the file operations in, None to skip.
+        """
+        self.host = host
+        self.record_file = record_file
+        self.target = target
+        self.speed = float(speed)
+        self.scratch_dir = scratch_dir
+        self.source_dir = str(get_configuration("watcher_source_dir"))
+        self.producer = None
+        self.consumer = None
+        self.event_filter = EventFilter()
+        self.class_logger = Logger('EventReplayer')
+
+    def setup_target(self) -> None:
+        """
+        Creates the producer or consumer to feed the events into.
+        """
+        if self.target == ReplayTargets.PRODUCER:
+            from producer import Producer
+            self.producer = Producer(self.host)
+        elif self.target == ReplayTargets.CONSUMER:
+            from consumer import Consumer
+            self.consumer = Consumer(self.host)
+            self.consumer.setup_consumer_db()
+        else:
+            raise ReplayError(f"[!] Unsupported replay target '{self.target}'.")
+        if self.scratch_dir:
+            os.makedirs(self.scratch_dir, exist_ok=True)
+
+    def map_path(self, path: str) -> str:
+        """
+        Maps a recorded path into the scratch directory when materializing.
+        :param path: For the recorded path.
+        :return: The path to use for the replayed event.
+        """
+        if not self.scratch_dir or not path:
+            return path
+        relative_path = os.path.relpath(path, self.source_dir)
+        if relative_path.startswith(os.pardir):
+            relative_path = path.lstrip(os.sep)
+        return os.path.join(self.scratch_dir, relative_path)
+
+    @staticmethod
+    def write_content(f, path: str, size: int, block_size: int = 1048576) -> None:
+        """
+        Writes pseudo random content seeded from the file path, so replayed files only share a hash
+        when they share a path, like distinct production files, and every replay writes the same content.
+        :param f: For the file opened for writing, at the position to write from.
+        :param path: For the file path seeding the content.
+        :param size: For the number of bytes to write.
+        :param block_size: For the number of bytes generated at once.
+        """
+        generator = random.Random(f"{path}:{f.tell()}")
+        while size > 0:
+            f.write(generator.randbytes(min(size, block_size)))
+            size -= block_size
+
+    @staticmethod
+    def materialize(event_type: str, is_directory: bool, size: int, src_path: str, dest_path: str) -> None:
+        """
+        Performs the recorded file operation so the consumer can read the replayed files.
+        :param event_type: For the recorded event type.
+        :param is_directory: For whether the event is a directory event.
+        :param size: For the recorded file size, -1 if unknown.
+        :param src_path: For the mapped source path.
+        :param dest_path: For the mapped destination path.
+        """
+        try:
+            if event_type == 'created':
+                if is_directory:
+                    os.makedirs(src_path, exist_ok=True)
+                    return None
+                os.makedirs(os.path.dirname(src_path), exist_ok=True)
+                with open(src_path, 'wb') as f:
+                    EventReplayer.write_content(f, src_path, size)
+            elif event_type == 'modified' and not is_directory and size >= 0:
+                with open(src_path, 'ab') as f:
+                    current_size = f.tell()
+                    if size > current_size:
+                        EventReplayer.write_content(f, src_path, size - current_size)
+                    else:
+                        f.truncate(size)
+            elif event_type == 'deleted':
+                if is_directory:
+                    os.rmdir(src_path)
+                else:
+                    os.remove(src_path)
+            elif event_type == 'moved':
+                os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                os.replace(src_path, dest_path)
+        except OSError:
+            # The recorded stream may reference files created before the recording started
+            pass
+
+    def dispatch(self, msg: str) -> None:
+        """
+        Feeds a single event message into the configured target.
+        :param msg: For the event message to send.
+        """
+        if self.producer is not None:
+            self.producer.publish(msg)
+        else:
+            self.consumer.handle_event(msg.encode())
+
+    def replay(self) -> int:
+        """
+        Replays the record file, keeping the recorded inter-event timing scaled by speed.
+        :return: The number of replayed events.
+        """
+        self.setup_target()
+        print(f"[+] Replaying '{self.record_file}' into the {self.target} at "
+              f"{'max' if self.speed <= 0 else f'{self.speed}x'} speed...")
+        start_time = monotonic()
+        events_count = 0
+        for event in read_record_file(self.record_file):
+            if self.speed > 0:
+                delay = event.offset / self.speed - (monotonic() - start_time)
+                if delay > 0:
+                    sleep(delay)
+            src_path = self.map_path(event.src_path)
+            dest_path = self.map_path(event.dest_path)
+            if self.scratch_dir:
+                self.materialize(event.event_type, event.is_directory, event.size, src_path, dest_path)
+            # Same filtering and message format as the FileChangeWatcher, moved events add their destination
+            if event.is_directory or not self.event_filter.accept(event.event_type, dest_path or src_path):
+                continue
+            msg = f"{event.event_type} {src_path}"
+            if dest_path:
+                msg = f"{msg} {dest_path}"
+            self.dispatch(msg)
+            events_count += 1
+        elapsed = monotonic() - start_time
+        print(f"[+] Replayed {events_count} events in {elapsed:.2f} seconds.")
+        self.class_logger.logger.info(f"Replayed {events_count} events from '{self.record_file}' "
+                                      f"in {elapsed:.2f} seconds.")
+        if self.producer is not None:
+            self.producer.close_connection()
+        return events_count
+
+
+"""
+Custom exception for replay errors.
+"""
+
+
+class ReplayError(Exception):
+    pass
+
+
+def replay_main():
+
+    scratch_dir = str(get_configuration("scratch_dir", "replayer"))
+    replayer = EventReplayer('localhost',
+                             str(get_configuration("file_name", "replayer")),
+                             str(get_configuration("target", "replayer")),
+                             get_configuration("speed", "replayer"),
+                             scratch_dir if scratch_dir else None)
+    try:
+        replayer.replay()
+    except ReplayError as err:
+        print(err)
+
+
+if __name__ == "__main__":
+    replay_main()
@@ -0,0 +1,316 @@
+"""
+Watched Root Class for watching one configured root directory with its own observer and exclusion rules,
+falling back to a scandir snapshot poller when the native watch limits are exhausted.
+"""
+import errno
+import os
+import resource
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Event
+from time import perf_counter
+from watchdog.observers import Observer
+from watchdog.events import FileCreatedEvent, FileDeletedEvent, FileModifiedEvent
+from logger import Logger
+
+
+# Kernel memory of one inotify watch on 64 bit systems, see inotify(7) max_user_watches
+INOTIFY_WATCH_SIZE = 1080
+
+
+class WatchModes:
+    AUTO = 'auto'
+    NATIVE = 'native'
+    POLLING = 'polling'
+
+
+class SnapshotPoller(Thread):
+    """
+    Polling observer diffing parallel os.scandir snapshots of a tree.
+    A snapshot maps every directory to a {file name: signature} dict, the signature being one int
+    computed from the file inode, size and modification time, so no stat results or full paths are kept.
+    """
+    def __init__(self, path: str, excluded_dirs: tuple, event_handler, poll_interval: float, scan_workers: int):
+        """
+        Class Constructor.
+        :param path: For the root directory to poll.
+        :param excluded_dirs: For the subtrees to leave out.
+        :param event_handler: For the watchdog event handler to dispatch the events to.
+        :param poll_interval: For the seconds between snapshots.
+        :param scan_workers: For the number of directories scanned in parallel.
+        """
+        super().__init__(name=f"SnapshotPoller {path}", daemon=True)
+        self.path = path
+        self.excluded_dirs = frozenset(excluded_dirs)
+        self.event_handler = event_handler
+        self.poll_interval = poll_interval
+        self.pool = ThreadPoolExecutor(scan_workers, thread_name_prefix='SnapshotScan')
+        self.stop_event = Event()
+        self.snapshot = {}
+
+    def scan_dir(self, path: str) -> tuple:
+        """
+        Scans a single directory.
+        :param path: For the directory to scan.
+        :return: The directory path, its {file name: signature} dict or None if unreadable, and its sub directories.
+        """
+        files = {}
+        sub_dirs = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.path not in self.excluded_dirs:
+                                sub_dirs.append(entry.path)
+                        else:
+                            st = entry.stat(follow_symlinks=False)
+                            files[entry.name] = hash((st.st_ino, st.st_size, st.st_mtime_ns))
+                    except OSError:
+                        # Removed while scanning
+                        continue
+        except OSError:
+            return path, None, sub_dirs
+        return path, files, sub_dirs
+
+    def scan(self) -> dict:
+        """
+        Takes a snapshot of the whole tree, one directory level at a time in parallel.
+        :return: The snapshot.
+        """
+        snapshot = {}
+        pending = [self.path]
+        while pending:
+            next_pending = []
+            for path, files, sub_dirs in self.pool.map(self.scan_dir, pending):
+                if files is not None:
+                    snapshot[path] = files
+                    next_pending.extend(sub_dirs)
+            pending = next_pending
+        return snapshot
+
+    def diff(self, old: dict, new: dict) -> None:
+        """
+        Dispatches the file events between two snapshots, a moved file shows as deleted and created.
+        :param old: For the previous snapshot.
+        :param new: For the current snapshot.
+        """
+        dispatch = self.event_handler.dispatch
+        for path, files in new.items():
+            old_files = old.get(path)
+            if old_files is None:
+                for name in files:
+                    dispatch(FileCreatedEvent(os.path.join(path, name)))
+                continue
+            for name, signature in files.items():
+                old_signature = old_files.get(name)
+                if old_signature is None:
+                    dispatch(FileCreatedEvent(os.path.join(path, name)))
+                elif old_signature != signature:
+                    dispatch(FileModifiedEvent(os.path.join(path, name)))
+            for name in old_files.keys() - files.keys():
+                dispatch(FileDeletedEvent(os.path.join(path, name)))
+        for path in old.keys() - new.keys():
+            for name in old[path]:
+                dispatch(FileDeletedEvent(os.path.join(path, name)))
+
+    def start(self) -> None:
+        """
+        Takes the initial snapshot and starts polling.
+        """
+        self.snapshot = self.scan()
+        super().start()
+
+    def run(self) -> None:
+        """
+        Polls the tree until stopped.
+        """
+        while not self.stop_event.wait(self.poll_interval):
+            snapshot = self.scan()
+            self.diff(self.snapshot, snapshot)
+            self.snapshot = snapshot
+
+    def stop(self) -> None:
+        """
+        Stops polling.
+        """
+        self.stop_event.set()
+        self.pool.shutdown(wait=False)
+
+    def count_entries(self) -> int:
+        """
+        Counts the directories and files in the current snapshot.
+        :return: The number of entries.
+        """
+        return len(self.snapshot) + sum(len(files) for files in self.snapshot.values())
+
+    def snapshot_size(self) -> int:
+        """
+        Estimates the current snapshot memory use.
+        :return: The snapshot size in bytes.
+        """
+        size = sys.getsizeof(self.snapshot)
+        for path, files in self.snapshot.items():
+            size += sys.getsizeof(path) + sys.getsizeof(files)
+            size += sum(sys.getsizeof(name) + sys.getsizeof(signature) for name, signature in files.items())
+        return size
+
+
+class WatchedRoot:
+
+    def __init__(self, path: str, excluded_dirs: list, mode: str, event_handler, poll_interval: float,
+                 scan_workers: int):
+        """
+        Class Constructor.
+        :param path: For the root directory to watch.
+        :param excluded_dirs: For the subtrees to leave out, absolute or relative to the root.
+        :param mode: For the watch mode, see WatchModes.
+        :param event_handler: For the watchdog event handler of this root.
+        :param poll_interval: For the seconds between snapshots in polling mode.
+        :param scan_workers: For the number of directories scanned in parallel in polling mode.
+        """
+        self.path = os.path.abspath(path)
+        self.excluded_dirs = tuple(os.path.abspath(os.path.join(self.path, excluded)) for excluded in excluded_dirs)
+        self.mode = mode
+        self.event_handler = event_handler
+        self.poll_interval = poll_interval
+        self.scan_workers = scan_workers
+        self.observer = None
+        self.watch_fds = set()
+        self.class_logger = Logger('WatchedRoot')
+
+    @staticmethod
+    def inotify_fds() -> set:
+        """
+        Lists the inotify file descriptors of this process.
+        :return: The file descriptors, empty where /proc is not available.
+        """
+        fds = set()
+        try:
+            for fd in os.listdir('/proc/self/fd'):
+                try:
+                    if os.readlink(f"/proc/self/fd/{fd}") == 'anon_inode:inotify':
+                        fds.add(fd)
+                except OSError:
+                    # Closed meanwhile
+                    continue
+        except OSError:
+            pass
+        return fds
+
+    def count_watches(self) -> int:
+        """
+        Counts the kernel watches of the root observer from its inotify file descriptors info, one line per watch,
+        so counting costs no tree walk.
+        :return: The number of watches, 0 if unknown.
+        """
+        count = 0
+        for fd in self.watch_fds:
+            try:
+                with open(f"/proc/self/fdinfo/{fd}") as fdinfo:
+                    count += sum(1 for line in fdinfo if line.startswith('inotify wd:'))
+            except OSError:
+                continue
+        return count
+
+    def plan_watches(self, path: str) -> list:
+        """
+        Plans the native watches so excluded subtrees are never watched:
+        directories leading to an excluded subtree are watched non recursively, all the others recursively.
+        Directories created later on the way to an excluded subtree are not watched.
+        :param path: For the directory to plan.
+        :return: The (path, recursive) watches list.
+        """
+        prefix = os.path.join(path, '')
+        if not any(excluded.startswith(prefix) for excluded in self.excluded_dirs):
+            return [(path, True)]
+        watches = [(path, False)]
+        try:
+            with os.scandir(path) as entries:
+                sub_dirs = [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+        except OSError:
+            return watches
+        for sub_dir in sub_dirs:
+            if sub_dir not in self.excluded_dirs:
+                watches.extend(self.plan_watches(sub_dir))
+        return watches
+
+    def start_native(self) -> None:
+        """
+        Starts a native watchdog observer.
+        """
+        self.observer = Observer()
+        for path, recursive in self.plan_watches(self.path):
+            self.observer.schedule(self.event_handler, path, recursive=recursive)
+        # The roots are started one after the other, so the new inotify descriptors belong to this root
+        existing_fds = self.inotify_fds()
+        try:
+            self.observer.start()
+        except OSError:
+            # Stops the emitters that did start
+            self.observer.stop()
+            raise
+        self.watch_fds = self.inotify_fds() - existing_fds
+
+    def start_polling(self) -> None:
+        """
+        Starts a snapshot poller.
+        """
+        self.observer = SnapshotPoller(self.path, self.excluded_dirs, self.event_handler, self.poll_interval,
+                                       self.scan_workers)
+        self.observer.start()
+        self.mode = WatchModes.POLLING
+
+    def start(self) -> None:
+        """
+        Starts watching the root, and reports the startup time and memory use, measured after the startup.
+        """
+        start_time = perf_counter()
+        start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if self.mode == WatchModes.POLLING:
+            self.start_polling()
+        else:
+            try:
+                self.start_native()
+                self.mode = WatchModes.NATIVE
+            except OSError as err:
+                if self.mode == WatchModes.NATIVE or err.errno not in (errno.ENOSPC, errno.EMFILE):
+                    raise
+                print(f"[!] Native watch limit reached for '{self.path}', falling back to polling.")
+                self.class_logger.logger.error("Native watch limit reached for '%s', falling back to polling, "
+                                               "Error: %s.", self.path, err)
+                self.start_polling()
+        startup_time = perf_counter() - start_time
+        self.report(startup_time, start_rss)
+
+    def report(self, startup_time: float, start_rss: int) -> None:
+        """
+        Reports the root startup time and memory use.
+        :param startup_time: For the startup time in seconds.
+        :param start_rss: For the process max resident set size in KB before starting.
+        Memory is given per million entries in polling mode, and per million watched directories in native mode.
+        """
+        rss_growth = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_rss) * 1024
+        details = f"max RSS grew by {rss_growth / 1048576:.1f} MB"
+        if isinstance(self.observer, SnapshotPoller):
+            entries = self.observer.count_entries()
+            if entries:
+                per_million = self.observer.snapshot_size() / entries * 1000000
+                details = f"{entries} entries, {per_million / 1048576:.1f} MB per million entries, {details}"
+        else:
+            # Files cost nothing natively, every watched directory costs its user space watch state and a kernel watch
+            watches = self.count_watches()
+            if watches:
+                per_million = rss_growth / watches * 1000000
+                details = (f"{watches} watched directories, {per_million / 1048576:.1f} MB per million directories "
+                           f"plus {INOTIFY_WATCH_SIZE * 1000000 / 1048576:.0f} MB of kernel watches, {details}")
+        print(f"[+] Watching '{self.path}' in {self.mode} mode, started in {startup_time:.2f} seconds, {details}.")
+        self.class_logger.logger.info("Watching '%s' in %s mode, started in %.2f seconds, %s.", self.path, self.mode,
+                                      startup_time, details)
+
+    def stop(self) -> None:
+        """
+        Stops watching the root.
+        """
+        if self.observer is not None:
+            self.observer.stop()
@@ -4,36 +4,56 @@ File Change Handler Class for watch the wanted folder for file changes.
 import pika
 import pika.exceptions
 from typing import Union
-from producer import Producer
+from producer import Producer, PublisherError
+from recorder import EventRecorder
+from event_filter import EventFilter
 from watchdog.events import FileSystemEventHandler, FileCreatedEvent
 
 
 class FileChangeWatcher(FileSystemEventHandler):
 
-    def __init__(self, host: str):
+    def __init__(self, host: str, excluded_dirs: tuple = (), recorder: EventRecorder = None):
         """
         Class Constructor.
+        :param host: For the RabbitMQ host.
+        :param excluded_dirs: For the watched root excluded subtrees.
+        :param recorder: For the optional recorder shared by all the watched roots.
         """
         self.producer = Producer(host)
         self.file_paths = []
+        self.event_filter = EventFilter(excluded_dirs)
+        self.recorder = recorder
 
     def on_any_event(self, event: Union[FileCreatedEvent]):
         """
         Method to send to RabbitMQ queue the file change event.
         :param event: For the event to send.
         """
+        # Capture the raw event stream before any filtering
+        if self.recorder is not None:
+            self.recorder.record(event)
+
         # Avoid directory changes
         if event.is_directory:
             return None
 
+        # Reject unwanted events before they are serialized, moved events are checked by their destination
+        if not self.event_filter.accept(event.event_type, getattr(event, 'dest_path', '') or event.src_path):
+            return None
+
         # Add the file creation path to path lists
         if isinstance(event, FileCreatedEvent):
             self.file_paths.append(event.src_path)
 
-        # Send event type and file path to RabbitMQ queue for further processing
+        # Send event type and file path to RabbitMQ queue for further processing, moved events add their destination
         msg = f"{event.event_type} {event.src_path}"
+        if getattr(event, 'dest_path', ''):
+            msg = f"{msg} {event.dest_path}"
         try:
             self.producer.publish(msg)
+        except PublisherError as err:
+            # Raising would stop the observer thread, the event is dropped instead
+            print(err)
         except (pika.exceptions.ConnectionClosed, pika.exceptions.StreamLostError, AttributeError) as err:
             print(f"[!] Unable to send event to RabbitMQ, Error: {err}, Trying to reconnect...")
             # In case connection will be terminated